@@ -1,29 +1,143 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# quaternion algebra of the FHA scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HelicalAxis-v1'))
+from fha_quaternion import load_sensor_quaternions, normalize_quaternions, quaternion_conjugate, quaternion_multiply
+
+
+##### Quaternion resampling on the rotation manifold (SLERP / SQUAD) #####
+
+def quaternion_log(q, eps=1e-12):
+    """Logarithm (N,3) of unit quaternions (N,4) (w,x,y,z): axis * half angle."""
+    sin_half = np.linalg.norm(q[:, 1:], axis=1)
+    half = np.arctan2(sin_half, q[:, 0])
+    scale = np.divide(half, sin_half, out=np.ones_like(half), where=sin_half > eps)
+    return q[:, 1:] * scale[:, None]
+
+def quaternion_exp(v, eps=1e-12):
+    """Exponential (N,4) of pure quaternions given by their vector part v (N,3)."""
+    half = np.linalg.norm(v, axis=1)
+    scale = np.divide(np.sin(half), half, out=np.ones_like(half), where=half > eps)
+    return np.column_stack((np.cos(half), v * scale[:, None]))
+
+def slerp(q0, q1, u, eps=1e-6):
+    """
+    Spherical linear interpolation between the rows of q0 and q1 (N,4) at the fractions u (N,).
+    Does not flip hemispheres, q1 has to be on the side of q0 for the shortest path.
+    """
+    d = np.clip(np.einsum('ij,ij->i', q0, q1), -1.0, 1.0)
+    theta = np.arccos(d)
+    sin_theta = np.sin(theta)
+    # nearly identical rotations: linear weights, renormalized below
+    small = sin_theta < eps
+    w0 = np.where(small, 1 - u, np.sin((1 - u) * theta) / np.where(small, 1.0, sin_theta))
+    w1 = np.where(small, u, np.sin(u * theta) / np.where(small, 1.0, sin_theta))
+    return normalize_quaternions(w0[:, None] * q0 + w1[:, None] * q1)
+
+def squad_control_points(q):
+    """
+    SQUAD control points s_i = q_i exp(-(log(q_i^-1 q_i+1) + log(q_i^-1 q_i-1)) / 4) of a quaternion stream (N,4).
+    The neighbours are moved to the hemisphere of q_i before the logarithm. The end points are their own control points.
+    """
+    s = q.copy()
+    if len(q) < 3:
+        return s
+    q_inv = quaternion_conjugate(q[1:-1])
+    d_next = quaternion_multiply(q_inv, q[2:])
+    d_prev = quaternion_multiply(q_inv, q[:-2])
+    d_next *= np.where(d_next[:, 0] < 0, -1.0, 1.0)[:, None]
+    d_prev *= np.where(d_prev[:, 0] < 0, -1.0, 1.0)[:, None]
+    s[1:-1] = quaternion_multiply(q[1:-1], quaternion_exp(-(quaternion_log(d_next) + quaternion_log(d_prev)) / 4))
+    return s
+
+def iter_resample_quaternions(t, q, t_new, method='slerp', chunk_size=65536):
+    """
+    Resamples a quaternion stream q (N,4) (w,x,y,z) with ascending timestamps t (N,) at the times t_new (M,),
+    in chunks of chunk_size target samples. Yields (start, q_new) with q_new the unit quaternions of
+    t_new[start:start+chunk_size]. Times outside of t are clamped to the first or last sample, as with np.interp.
+    method is 'slerp' (shortest path between the bracketing samples) or 'squad' (smooth across samples).
+    The hemisphere of every bracket is fixed first, q and -q are the same rotation.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    q = normalize_quaternions(np.asarray(q, dtype=np.float64))
+    t_new = np.asarray(t_new, dtype=np.float64)
+    if method not in ('slerp', 'squad'):
+        raise ValueError("unknown interpolation method " + str(method))
+    if len(t) == 1:
+        for start in range(0, len(t_new), chunk_size):
+            yield start, np.repeat(q, len(t_new[start:start + chunk_size]), axis=0)
+        return
+    if method == 'squad':
+        s = squad_control_points(q)
+
+    for start in range(0, len(t_new), chunk_size):
+        t_chunk = t_new[start:start + chunk_size]
+
+        # bracketing samples i, i+1 and the fraction u between them
+        i = np.clip(np.searchsorted(t, t_chunk, side='right') - 1, 0, len(t) - 2)
+        u = np.clip((t_chunk - t[i]) / (t[i + 1] - t[i]), 0.0, 1.0)
+
+        # hemisphere of the bracket
+        q0, q1 = q[i], q[i + 1]
+        sign = np.where(np.einsum('ij,ij->i', q0, q1) < 0, -1.0, 1.0)[:, None]
+        q1 = q1 * sign
+
+        if method == 'slerp':
+            yield start, slerp(q0, q1, u)
+        else:
+            s0, s1 = s[i], s[i + 1] * sign
+            yield start, slerp(slerp(q0, q1, u), slerp(s0, s1, u), 2 * u * (1 - u))
+
+def resample_quaternions(t, q, t_new, method='slerp', chunk_size=65536):
+    """Resamples a quaternion stream q (N,4) with timestamps t at the times t_new, see iter_resample_quaternions."""
+    q_new = np.empty((len(t_new), 4))
+    for start, q_chunk in iter_resample_quaternions(t, q, t_new, method, chunk_size):
+        q_new[start:start + len(q_chunk)] = q_chunk
+    return q_new
+
+
 ##### This function can be used to double the amount of data using interpolation #####
 
-def interpolate_quaternions(csv_file):
+def interpolate_quaternions(csv_file, factor=2, method='slerp', out_file=None, chunk_size=65536):
+    """
+    Resamples both sensors of a CSV file to factor times the number of rows, evenly spaced between
+    the first and last timestamp. Returns the rows (time, q1 w,x,y,z, q2 w,x,y,z).
+    With out_file, the rows are written chunk by chunk to that CSV file instead and None is returned.
+    """
     # Read the CSV file into a DataFrame
     df = pd.read_csv(csv_file)
 
-    # Extract the necessary columns
+    # Extract the necessary columns (continuous quaternion streams)
     timestamps = df['Time'].values
-    quaternions_s1 = df[['w1', 'x1', 'y1', 'z1']].values
-    quaternions_s2 = df[['w2', 'x2', 'y2', 'z2']].values
+    quaternions_s1, quaternions_s2 = load_sensor_quaternions(df)
 
     # Interpolate timestamps
-    interpolated_timestamps = np.linspace(timestamps[0], timestamps[-1], len(timestamps) * 2)
+    interpolated_timestamps = np.linspace(timestamps[0], timestamps[-1], len(timestamps) * factor)
 
-    # Interpolate quaternions
-    interpolated_quaternions_s1 = np.zeros((len(interpolated_timestamps), 4))
-    for i in range(4):
-        interpolated_quaternions_s1[:, i] = np.interp(interpolated_timestamps, timestamps, quaternions_s1[:, i])
+    # Interpolate quaternions, both sensors chunk by chunk
+    chunks = zip(iter_resample_quaternions(timestamps, quaternions_s1, interpolated_timestamps, method, chunk_size),
+                 iter_resample_quaternions(timestamps, quaternions_s2, interpolated_timestamps, method, chunk_size))
 
-    interpolated_quaternions_s2 = np.zeros((len(interpolated_timestamps), 4))
-    for i in range(4):
-        interpolated_quaternions_s2[:, i] = np.interp(interpolated_timestamps, timestamps, quaternions_s2[:, i])
+    if out_file is None:
+        interpolated_data = np.empty((len(interpolated_timestamps), 9))
+        interpolated_data[:, 0] = interpolated_timestamps
+        for (start, q1), (_, q2) in chunks:
+            interpolated_data[start:start + len(q1), 1:5] = q1
+            interpolated_data[start:start + len(q1), 5:9] = q2
+        return interpolated_data
 
-    # Combine timestamps and quaternions
-    interpolated_data = np.column_stack((interpolated_timestamps, interpolated_quaternions_s1, interpolated_quaternions_s2))
+    header_row = ['time', 'q1_w', 'q1_x', 'q1_y', 'q1_z', 'q2_w', 'q2_x', 'q2_y', 'q2_z']
+    with open(out_file, 'w') as file:
+        file.write(','.join(header_row) + '\n')
+        for (start, q1), (_, q2) in chunks:
+            rows = np.column_stack((interpolated_timestamps[start:start + len(q1)], q1, q2))
+            np.savetxt(file, rows, fmt='%.17g', delimiter=',')
 
-    return interpolated_data
 
-interpolated_data = interpolate_quaternions(data)
+if __name__ == '__main__':
+    path = './test_data/IMU_test_data/'
+    filename = '90deg_x.csv'
+    interpolate_quaternions(path + filename, out_file=path + filename.replace('.csv', '-interpolated.csv'))
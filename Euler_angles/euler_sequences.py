@@ -0,0 +1,83 @@
+import numpy as np
+
+# extrinsic (lowercase, as in scipy's as_euler) Tait-Bryan and proper Euler sequences
+EULER_SEQUENCES = ['xyz', 'xzy', 'yxz', 'yzx', 'zxy', 'zyx', 'xyx', 'xzx', 'yxy', 'yzy', 'zxz', 'zyz']
+
+# one (N,) record per row, one (3,) angle field per sequence
+EULER_DTYPE = np.dtype([(seq, np.float64, (3,)) for seq in EULER_SEQUENCES])
+
+
+def quaternion_matrices(q):
+    """Rotation matrices (N,3,3) of unit quaternions (N,4) (w,x,y,z), every product of two components is computed once."""
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    xx, yy, zz = x * x, y * y, z * z
+    xy, xz, yz = x * y, x * z, y * z
+    wx, wy, wz = w * x, w * y, w * z
+    R = np.stack((1 - 2 * (yy + zz), 2 * (xy - wz), 2 * (xz + wy),
+                  2 * (xy + wz), 1 - 2 * (xx + zz), 2 * (yz - wx),
+                  2 * (xz - wy), 2 * (yz + wx), 1 - 2 * (xx + yy)), axis=-1)
+    return R.reshape(q.shape[:-1] + (3, 3))
+
+def axis_rotations(axis, angle):
+    """Rotation matrices (N,3,3) about the coordinate axis 0, 1 or 2 by the angles (N,) (rad)."""
+    j1, j2 = (axis + 1) % 3, (axis + 2) % 3
+    R = np.zeros(angle.shape + (3, 3))
+    R[:, axis, axis] = 1
+    R[:, j1, j1] = R[:, j2, j2] = np.cos(angle)
+    R[:, j2, j1] = np.sin(angle)
+    R[:, j1, j2] = -R[:, j2, j1]
+    return R
+
+def all_euler_sequences(q, degrees=True, eps=1e-7):
+    """
+    Euler angles of the unit quaternions (N,4) (w,x,y,z) in all 12 sequences of EULER_SEQUENCES,
+    from one rotation matrix stack. Returns a structured array of EULER_DTYPE, e.g. angles['xyz'] is (N,3).
+    The angles follow scipy's extrinsic convention (as_euler with lowercase sequences).
+    The argument of the arcsine (arccos for proper Euler sequences) is clamped to [-1,1].
+    At gimbal lock (middle angle within eps of the singularity) the third angle is set to 0.
+    """
+    # matrix entries as contiguous rows, R[m,n] is (N,)
+    R = np.moveaxis(quaternion_matrices(np.asarray(q, dtype=np.float64)), 0, -1).copy()
+    angles = np.empty(R.shape[-1], dtype=EULER_DTYPE)
+
+    for seq in EULER_SEQUENCES:
+        # extrinsic a,b,c equals intrinsic c,b,a with reversed angles: R = R_i(first) R_j(middle) R_last(third)
+        i, j, last = ('xyz'.index(axis) for axis in seq[::-1])
+        k = 3 - i - j
+        s = 1.0 if (j - i) % 3 == 1 else -1.0 # parity of (i,j,k)
+
+        if last != i:
+            # Tait-Bryan
+            middle = np.arcsin(np.clip(s * R[i, k], -1.0, 1.0))
+            first = np.arctan2(-s * R[j, k], R[k, k])
+            third = np.arctan2(-s * R[i, j], R[i, i])
+            lock = np.hypot(R[i, i], R[i, j]) < eps
+        else:
+            # proper Euler
+            middle = np.arccos(np.clip(R[i, i], -1.0, 1.0))
+            first = np.arctan2(R[j, i], -s * R[k, i])
+            third = np.arctan2(R[i, j], s * R[i, k])
+            lock = np.hypot(R[i, j], R[i, k]) < eps
+
+        if np.any(lock):
+            # the first and third rotation share an axis: first = 0, R_last(third) = R_j(middle)^T R
+            first[lock] = 0
+            M = np.swapaxes(axis_rotations(j, middle[lock]), 1, 2) @ np.moveaxis(R[:, :, lock], -1, 0)
+            l1, l2 = (last + 1) % 3, (last + 2) % 3
+            third[lock] = np.arctan2(M[:, l2, l1], M[:, l1, l1])
+
+        seq_angles = np.stack((third, middle, first), axis=-1)
+        angles[seq] = np.degrees(seq_angles) if degrees else seq_angles
+
+    return angles
+
+def sensor_euler_zyx(q):
+    """
+    Euler angles (N,3) in degrees of unit quaternions (N,4) in the ZYX sequence, as the columns X, Y, Z
+    of the sensor plots. The argument of the arcsine is clamped to [-1,1] against rounding at gimbal lock.
+    """
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    Z = np.arctan2(2 * (w * x - z * y), 1 - 2 * (x * x + y * y))
+    Y = np.arcsin(np.clip(2 * (w * y + z * x), -1.0, 1.0))
+    X = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    return np.degrees(np.stack((X, Y, Z), axis=-1))
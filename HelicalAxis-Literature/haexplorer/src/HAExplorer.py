@@ -4,6 +4,7 @@
 # -----------------------------------------------------------------------------
 
 import sys
+import multiprocessing
 from glob import glob
 from time import perf_counter
 from datetime import datetime
@@ -85,6 +86,7 @@ class GLWindow(QOpenGLWindow):
         self.selection_tooltips = []
         self.HA_tooltip = "no tooltip set"
         self.active_colors = [False] * len(CORR_COLORS_NORM)
+        self.color_by_cluster = False
         self.tooltip_font = QFont("Helvetica", 18)
         self.tooltip_rectangle = QRectF(0, self.height() / 1.3, self.width(), 80)
         self.tooltip_color = QColor(200, 200, 200)
@@ -185,25 +187,17 @@ class GLWindow(QOpenGLWindow):
 
         # load filenames
         model_names = sorted(glob(scene_path + "/*.obj"))
-        pos_names   = sorted(glob(self.motion_path + "/*pos.txt"))
-        rot_names   = sorted(glob(self.motion_path + "/*rot.txt"))
-        
-        # check if R,v exist per object
-        if not (len(model_names) == len(pos_names) == len(rot_names)):
-            # see if marker files exist, convert them
-            marker_names = sorted(glob(self.motion_path + "/*marker.txt"))
-            for name in marker_names:
-                conversions.markerToRv(name)
-            # try laoding again
-            pos_names = sorted(glob(self.motion_path + "/*pos.txt"))
-            rot_names = sorted(glob(self.motion_path + "/*rot.txt"))
-
-        assert(len(model_names) == len(pos_names) == len(rot_names))
+
+        # convert new or changed marker files to R,v (unchanged files are skipped)
+        conversions.markerFolderToRv(self.motion_path)
+        motion_sources = conversions.motionFiles(self.motion_path)
+
+        assert(len(model_names) == len(motion_sources))
 
         # create one model per file
         for i in range(len(model_names)):
             # load one vertebra model
-            v = geometry.referenceGeometry(model_names[i], pos_names[i], rot_names[i], i, scale=settings['models_scale'])
+            v = geometry.referenceGeometry(model_names[i], motion_sources[i], i, scale=settings['models_scale'])
             self.vertebrae.append(v)
             vertebrae_animation_steps.append(len(v.model_matrices))
 #
@@ -394,6 +388,9 @@ class GLWindow(QOpenGLWindow):
             l_p = [glyph.instance_parameters_l[t_index_preview_gap]]
             glyph.scatterplot_l_phi_preview.setData(phi_p, l_p)
 
+            # mark the frames with axes close to the previewed one (live view)
+            glyph.updateSimilarFrames(t_index_preview_gap, self.timeloop.preview_active)
+
         # surface shader
         # ----------------------------------------
         gl.glUseProgram(self.shader_surface)
@@ -439,8 +436,8 @@ class GLWindow(QOpenGLWindow):
                 y = event.localPos().y()
                 index = gl.glReadPixels(x, self.height() - y - 1, 1, 1, gl.GL_STENCIL_INDEX, gl.GL_UNSIGNED_INT)[0][0]
                 if index != 255:
-                    # if a FHAworld is computed only one object needs to be selected
-                    if self.HA_compute_method == "FHAworld":
+                    # if a FHAworld/IHAworld is computed only one object needs to be selected
+                    if self.HA_compute_method in ["FHAworld", "IHAworld"]:
                         self.addHA(None, self.vertebrae[index], self.HA_compute_method)
                         self.__resetSelectionMode()
                     else:
@@ -533,7 +530,10 @@ class GLWindow(QOpenGLWindow):
                 break
         s = self.timeloop.t_span / self.timeloop.index_span
         g = geometry.glyphGeometry(GLYPH_PATH_SHAFT, GLYPH_PATH_TIP, ref, tar, color, s, method)
+        if self.color_by_cluster:
+            g.setColorByCluster(True)
         self.add_checkbox_func(g)
+        self.updateScatterColors(g)
         self.glyphs.append(g)
 
     def setGlyphThickness(self, thickness):
@@ -582,10 +582,31 @@ class GLWindow(QOpenGLWindow):
         time_axis = np.linspace(self.timeloop.t_min, self.timeloop.t_max, self.timeloop.index_span)
         for g in self.glyphs:
             g.scatterplot_l_phi.setData(g.instance_parameters['phi'], g.instance_parameters_l)
+            g.similar_frame = None # re-marked with the new l in the next frame
+            self.updateScatterColors(g)
             if not g.visible:
                 g.scatterplot_l_phi.setPointsVisible(False)
             g.lineplot_l.setData(x=time_axis, y=g.instance_parameters_l)
 
+    def setClusterColors(self, by_cluster):
+        """
+        Colors glyphs and scatterplot points by axis cluster instead of by time / glyph set.
+        """
+        self.color_by_cluster = bool(by_cluster)
+        for g in self.glyphs:
+            g.setColorByCluster(self.color_by_cluster)
+            self.updateScatterColors(g)
+            if not g.visible:
+                g.scatterplot_l_phi.setPointsVisible(False)
+
+    def updateScatterColors(self, glyph):
+        if glyph.color_by_cluster:
+            colors = (glyph.instance_parameters['color'] * 255.0).astype(np.int16)
+            glyph.scatterplot_l_phi.setBrush([pg.mkBrush(c[0], c[1], c[2], 255) for c in colors])
+        else:
+            color = (glyph.corr_color * 255.0).astype(np.int16)
+            glyph.scatterplot_l_phi.setBrush(QColor(color[0], color[1], color[2], 255))
+
     def setR0_loc(self, name):
         self.tt.logAction(self.tt.TYPE_GLYPH_SETTINGS)
         if name == "World Origin":
@@ -617,11 +638,11 @@ class GLWindow(QOpenGLWindow):
         self.motion_path = motion_path
 
         # update model matrices of each vertebra
-        pos_names = sorted(glob(self.motion_path + "/*pos.txt"))
-        rot_names = sorted(glob(self.motion_path + "/*rot.txt"))
-        assert(len(pos_names) == len(rot_names))
-        for i in range(len(pos_names)):
-            self.vertebrae[i].loadModelMatrices(pos_names[i], rot_names[i], scale=settings['models_scale'])
+        conversions.markerFolderToRv(self.motion_path)
+        motion_sources = conversions.motionFiles(self.motion_path)
+        assert(len(motion_sources) == len(self.vertebrae))
+        for i in range(len(motion_sources)):
+            self.vertebrae[i].loadModelMatrices(motion_sources[i], scale=settings['models_scale'])
 
         # update glyphs (glyphs know their associated models)
         time_axis = np.linspace(self.timeloop.t_min, self.timeloop.t_max, self.timeloop.index_span)
@@ -631,6 +652,7 @@ class GLWindow(QOpenGLWindow):
                 glyph.instance_parameters_l = np.abs(glyph.instance_parameters['l'])
             glyph.scatterplot_l_phi.setData(glyph.instance_parameters['phi'],
                                             glyph.instance_parameters_l)
+            self.updateScatterColors(glyph)
             glyph.lineplot_phi.setData(x=time_axis, y=glyph.instance_parameters['phi'])
             glyph.lineplot_l.setData(x=time_axis, y=glyph.instance_parameters_l)
             
@@ -708,8 +730,18 @@ class MainWindow(QMainWindow):
         self.cb_abs.setChecked(False)
         self.cb_abs.setText("|Translation Vel.|")
         self.cb_abs.stateChanged[int].connect(self.setLAbs)
+        self.cb_cluster = QCheckBox()
+        self.cb_cluster.setChecked(False)
+        self.cb_cluster.setText("Color by Cluster")
+        self.cb_cluster.setToolTip("Color axes by dominant axis (DBSCAN on axis distance and angle).")
+        self.cb_cluster.stateChanged[int].connect(self.setClusterColors)
         self.scatterplot_l_phi = helperQt.Scatter2D()
         self.scatterplot_l_phi.roi.sigRegionChanged.connect(self.ROIchanged)
+        self.scatterplot_l_phi.roi.sigRegionChangeFinished.connect(self.updateDispersion)
+        self.roi_range = (-10000, 10000, -10000, 10000) # phi_min, phi_max, l_min, l_max
+        self.label_dispersion = QLabel()
+        self.label_dispersion.setToolTip("95% confidence ellipse of the axes within the ROI,\n"
+                                         "intersected with the plane normal to their average axis.")
 
         # lineplot widgets
         widget_lineplot = pg.GraphicsLayoutWidget()
@@ -753,9 +785,11 @@ class MainWindow(QMainWindow):
         layout_scatter_settings.setAlignment(Qt.AlignLeft)
         layout_scatter_settings.addWidget(cb_roi)
         layout_scatter_settings.addWidget(self.cb_abs)
+        layout_scatter_settings.addWidget(self.cb_cluster)
         self.layout_plots = QVBoxLayout()
         self.layout_plots.addLayout(layout_scatter_settings)
         self.layout_plots.addWidget(self.scatterplot_l_phi)
+        self.layout_plots.addWidget(self.label_dispersion)
         self.layout_plots.addWidget(widget_lineplot)
 
         # create a settings dock widget
@@ -797,6 +831,14 @@ class MainWindow(QMainWindow):
         button_FHAref.setCheckable(False)
         button_FHAref.clicked.connect(self.addFHAref)
         button_FHAref.setToolTip("Compute the finite helical axes of an object's movements regarding a base object.")
+        button_IHAworld = QPushButton("Add IHA World")
+        button_IHAworld.setCheckable(False)
+        button_IHAworld.clicked.connect(self.addIHAworld)
+        button_IHAworld.setToolTip("Compute the instantaneous helical axes of an object's movements in the world.")
+        button_IHAref = QPushButton("Add IHA Base")
+        button_IHAref.setCheckable(False)
+        button_IHAref.clicked.connect(self.addIHAref)
+        button_IHAref.setToolTip("Compute the instantaneous helical axes of an object's movements regarding a base object.")
         button_export = QPushButton("Export Axes")
         button_export.setCheckable = False
         button_export.clicked.connect(self.exportFHA)
@@ -833,6 +875,10 @@ class MainWindow(QMainWindow):
         layout_FHA_buttons.addWidget(button_FHAworld)
         layout_FHA_buttons.addWidget(button_FHAref)
         layout_settings.addLayout(layout_FHA_buttons)
+        layout_IHA_buttons = QHBoxLayout()
+        layout_IHA_buttons.addWidget(button_IHAworld)
+        layout_IHA_buttons.addWidget(button_IHAref)
+        layout_settings.addLayout(layout_IHA_buttons)
         layout_settings.addStretch(1)
         layout_settings.addWidget(button_export)
 
@@ -929,6 +975,18 @@ class MainWindow(QMainWindow):
         self.view_main.HA_tooltip = FHA_BASE_TOOLTIPS[0]
         self.view_main.activateSelectionMode()
     
+    def addIHAworld(self):
+        self.view_main.HA_compute_method = "IHAworld"
+        self.view_main.selection_tooltips = IHA_WORLD_TOOLTIPS
+        self.view_main.HA_tooltip = IHA_WORLD_TOOLTIPS[0]
+        self.view_main.activateSelectionMode()
+
+    def addIHAref(self):
+        self.view_main.HA_compute_method = "IHAref"
+        self.view_main.selection_tooltips = IHA_BASE_TOOLTIPS
+        self.view_main.HA_tooltip = IHA_BASE_TOOLTIPS[0]
+        self.view_main.activateSelectionMode()
+
     def addFHAref2(self):
         self.view_main.HA_compute_method = "FHAref_projectFirst"
         self.view_main.selection_tooltips = FHA_BASE_TOOLTIPS
@@ -957,14 +1015,14 @@ class MainWindow(QMainWindow):
         # add scatterplot and lineplots of phi/l
         if self.cb_abs.isChecked():
             glyph.instance_parameters_l = np.abs(glyph.instance_parameters['l'])
-        s, st, s_preview = self.scatterplot_l_phi.addPlotItem(glyph.instance_parameters['phi'],
+        s, st, s_preview, s_similar = self.scatterplot_l_phi.addPlotItem(glyph.instance_parameters['phi'],
                                                glyph.instance_parameters_l,
                                                color)
         time_axis = np.linspace(self.timeloop.t_min, self.timeloop.t_max, self.timeloop.index_span)
         lp_phi = self.lineplot_phi.plot(x=time_axis, y=glyph.instance_parameters['phi'], pen=color)
         lp_l = self.lineplot_l.plot(x=time_axis, y=glyph.instance_parameters_l, pen=color)
 
-        glyph.registerPlotItems(s, st, s_preview, lp_phi, lp_l)
+        glyph.registerPlotItems(s, st, s_preview, s_similar, lp_phi, lp_l)
 
         # create a new checkbox for this glyph set
         c = QCheckBox()
@@ -975,8 +1033,10 @@ class MainWindow(QMainWindow):
         c.stateChanged[int].connect(s.setPointsVisible)
         c.stateChanged[int].connect(st.setPointsVisible)
         c.stateChanged[int].connect(s_preview.setPointsVisible)
+        c.stateChanged[int].connect(s_similar.setPointsVisible)
         c.stateChanged[int].connect(lp_phi.setVisible)
         c.stateChanged[int].connect(lp_l.setVisible)
+        c.stateChanged[int].connect(self.updateDispersion)
 
         # set the checkbox color
         p = QPalette()
@@ -998,6 +1058,9 @@ class MainWindow(QMainWindow):
         self.layout_HA_sets.addLayout(l)
         self.layout_HA_sets.removeItem
 
+        # the glyph set is listed as visible after this returns
+        QTimer.singleShot(0, self.updateDispersion)
+
     def ROIchanged(self):
         self.tt.logAction(self.tt.TYPE_ATT_FILTER)
         p = self.scatterplot_l_phi.roi.pos()
@@ -1012,6 +1075,21 @@ class MainWindow(QMainWindow):
             l_min, l_max = l_max, l_min
         self.view_main.setPhiLThreshold(phi_min, phi_max, l_min, l_max)
         self.export_dialog.setROIrange(phi_min, phi_max, l_min, l_max)
+        self.roi_range = (phi_min, phi_max, l_min, l_max)
+
+    def updateDispersion(self):
+        """
+        Shows the dispersion of the axes within the ROI for each visible glyph set.
+        """
+        lines = []
+        for g in self.view_main.glyphs_visible:
+            analysis = g.roiDispersion(*self.roi_range)
+            if analysis is None:
+                lines.append(g.name + ": -")
+            else:
+                lines.append(g.name + ": dispersion a = {:.1f} mm, b = {:.1f} mm ({} axes)".format(
+                             analysis['ma'] * 1000.0, analysis['mb'] * 1000.0, analysis['count']))
+        self.label_dispersion.setText("\n".join(lines))
 
     def toggleROI(self, state):
         self.tt.logAction(self.tt.TYPE_ATT_FILTER)
@@ -1019,6 +1097,8 @@ class MainWindow(QMainWindow):
             self.scatterplot_l_phi.showROI(False)
             self.export_dialog.setROIFilterEnabled(False)
             self.view_main.setPhiLThreshold(-10000, 10000, -10000, 10000)
+            self.roi_range = (-10000, 10000, -10000, 10000)
+            self.updateDispersion()
         else:
             self.scatterplot_l_phi.showROI(True)
             self.export_dialog.setROIFilterEnabled(True)
@@ -1027,6 +1107,7 @@ class MainWindow(QMainWindow):
     def setLAbs(self, set_abs):
         self.tt.logAction(self.tt.TYPE_ABS_TRANS)
         self.view_main.setLAbs(set_abs)
+        self.updateDispersion()
         if set_abs:
             self.lineplot_l.setLabel('left', "|Translation Vel.| (m/s)", **LABEL_STYLE)
             self.scatterplot_l_phi.setLabel('left', "|Translation Vel.| (m/s)", **LABEL_STYLE)
@@ -1034,6 +1115,10 @@ class MainWindow(QMainWindow):
             self.lineplot_l.setLabel('left', "Translation Vel. (m/s)", **LABEL_STYLE)
             self.scatterplot_l_phi.setLabel('left', "Translation Vel. (m/s)", **LABEL_STYLE)
 
+    def setClusterColors(self, by_cluster):
+        self.tt.logAction(self.tt.TYPE_GLYPH_SETTINGS)
+        self.view_main.setClusterColors(by_cluster)
+
     def deleteGlyphs(self):
         # search for glyphs to be deleted
         self.tt.logAction(self.tt.TYPE_RM_AXIS)
@@ -1048,7 +1133,8 @@ class MainWindow(QMainWindow):
             s = g.scatterplot_l_phi
             st = g.scatterplot_l_phi_time
             s_preview = g.scatterplot_l_phi_preview
-            self.scatterplot_l_phi.removePlotItems(s, st, s_preview)
+            s_similar = g.scatterplot_l_phi_similar
+            self.scatterplot_l_phi.removePlotItems(s, st, s_preview, s_similar)
             self.lineplot_phi.removeItem(g.lineplot_phi)
             self.lineplot_l.removeItem(g.lineplot_l)
 
@@ -1067,6 +1153,7 @@ class MainWindow(QMainWindow):
 
         # update the view
         self.view_main.updateRenderLists()
+        self.updateDispersion()
 
     def loadSettings(self, file):
         f = open(file)
@@ -1108,6 +1195,9 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == '__main__':
+    # worker processes (marker conversion) in frozen executables
+    multiprocessing.freeze_support()
+
     # create an application context
     app = QApplication(sys.argv)
     app.setOrganizationName("VisGroup Uni Jena")
@@ -0,0 +1,691 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021 Pepe Eulzer. All rights reserved.
+# Distributed under the (new) BSD License.
+# -----------------------------------------------------------------------------
+
+import heapq
+from itertools import product
+
+import numpy as np
+
+# chi2inv(0.95, 2), scale of the 95% confidence ellipse
+CHI2_95_2DOF = 5.991464547107979
+
+def planeIntersections(axes, refT=np.eye(4), d=1.0, max_dist=100.0):
+    """
+    Intersects a set of axes with a reference plane, see dispersionAnalysis.m.
+    axes is an (N,6) array [n, s] of axis directions and support points,
+    e.g. np.hstack((n, r0)). The plane is normal to the z-axis of the 4x4
+    reference frame refT, at distance d from its origin along z.
+    Axes that are (nearly) parallel to the plane, undefined (n = 0), or whose
+    intersection is further than max_dist from s yield NaN.
+    Unlike dispersionAnalysis.m, which intersects the segment s +- 100*n but
+    keeps intersections outside of it and returns [0 0 0] for parallel axes,
+    these axes are excluded rather than placed at arbitrary points.
+    The intersections of all axes only need to be computed once, subsets
+    (e.g. a phi/L ROI) can then be analyzed with ellipseFit.
+
+    Returns:
+      - points: (N,2) intersections in plane coordinates (x,y of refT)
+      - Tpl: 4x4 frame of the plane
+    """
+    axes = np.asarray(axes, dtype=np.float64)
+    n_axis = axes[:,0:3]
+    s_axis = axes[:,3:6]
+
+    # plane frame, z-axis is the plane normal
+    e1 = refT[0:3,0]
+    e2 = refT[0:3,1]
+    e3 = refT[0:3,2] / np.linalg.norm(refT[0:3,2])
+    O = refT[0:3,3] + d * e3
+    Tpl = np.eye(4)
+    Tpl[0:3,0] = e1
+    Tpl[0:3,1] = e2
+    Tpl[0:3,2] = e3
+    Tpl[0:3,3] = O
+
+    # line-plane intersection s + t*n for all axes
+    D = n_axis @ e3
+    N = (O - s_axis) @ e3
+    valid = np.abs(D) >= 1e-7
+    t = np.full(D.shape, np.nan)
+    t[valid] = N[valid] / D[valid]
+    t[np.abs(t) > max_dist] = np.nan
+    inters = s_axis + t[:,None] * n_axis
+
+    # intersection seen in the plane system
+    points = (inters - O) @ np.stack((e1, e2), axis=1)
+
+    return points, Tpl
+
+def ellipseFit(points, beta_chi2=CHI2_95_2DOF):
+    """
+    Fits a confidence ellipse to 2D points (N,2), see ellipse_fit.m.
+    Rows containing NaN are ignored. beta_chi2 is the chi^2 value of the
+    confidence level with 2 degrees of freedom (default 95%).
+
+    Returns the center o, the major/minor directions va, vb and
+    the semi-axis lengths ma, mb.
+    """
+    points = points[~np.isnan(points).any(axis=1)]
+    if points.shape[0] < 2:
+        nan2 = np.full(2, np.nan)
+        return nan2, nan2, nan2, np.nan, np.nan
+
+    o = np.mean(points, axis=0)
+    p = points - o
+    C = (p.T @ p) / (points.shape[0] - 1)
+    U, S, _ = np.linalg.svd(C)
+    ma, mb = np.sqrt(beta_chi2 * S)
+
+    return o, U[:,0], U[:,1], ma, mb
+
+def dispersionAnalysis(axes, refT=np.eye(4), d=1.0, mask=None):
+    """
+    Dispersion of a set of axes (N,6) [n, s] around a reference axis,
+    see dispersionAnalysis.m: intersections with the plane at distance d
+    along the z-axis of refT, and the 95% confidence ellipse of these.
+    mask optionally selects a subset (e.g. axes within the phi/L ROI).
+    Undefined intersections (see planeIntersections) are dropped, whereas
+    dispersionAnalysis.m fills them with the mean intersection; that keeps
+    the count but shrinks the ellipse on sparse selections.
+
+    Returns a dict with the ellipse (o, va, vb, ma, mb), the intersections
+    x, y in plane coordinates, and the plane frame Tpl.
+    """
+    points, Tpl = planeIntersections(axes, refT, d)
+    if mask is not None:
+        points = points[mask]
+    o, va, vb, ma, mb = ellipseFit(points)
+
+    return {'o': o, 'va': va, 'vb': vb, 'ma': ma, 'mb': mb,
+            'x': points[:,0], 'y': points[:,1], 'Tpl': Tpl}
+
+def toPlucker(n, r0, dtype=np.float64):
+    """
+    Converts axes given by direction n (N,3) and support vector r0 (N,3)
+    to Plücker coordinates (N,6) [n, m] with unit n and moment m = r0 x n.
+    Undefined axes (n = 0) stay zero.
+    """
+    n = np.asarray(n, dtype=np.float64)
+    length = np.linalg.norm(n, axis=1, keepdims=True)
+    n = np.divide(n, length, out=np.zeros(n.shape), where=length > 0)
+    m = np.cross(r0, n)
+    return np.hstack((n, m)).astype(dtype)
+
+def fromPlucker(L):
+    """
+    Converts Plücker coordinates (N,6) back to directions n and
+    support vectors r0 = n x m (the axis points closest to the origin).
+    """
+    n = L[:,0:3]
+    return n, np.cross(n, L[:,3:6])
+
+def axisDistances(La, Lb):
+    """
+    Pairwise line-to-line distances and angles between two sets of axes in
+    Plücker coordinates, La (N,6) and Lb (M,6), see l2lDist.m and compareAxes.m.
+
+    Returns two (N,M) arrays:
+      - dist: shortest distance between the lines
+      - ang: angle between the lines in [0,pi/2] (rad)
+    """
+    na, ma = La[:,0:3], La[:,3:6]
+    nb, mb = Lb[:,0:3], Lb[:,3:6]
+
+    # |n_a . n_b| = cos(angle), |n_a x n_b| = sin(angle)
+    cos_ab = na @ nb.T
+    sin_ab = np.sqrt(np.clip(1.0 - cos_ab**2, 0.0, None))
+    ang = np.arccos(np.clip(np.abs(cos_ab), 0.0, 1.0))
+
+    # skew lines: reciprocal product over sin
+    reciprocal = np.abs(na @ mb.T + ma @ nb.T)
+    parallel = sin_ab < 1e-6
+    dist = np.divide(reciprocal, sin_ab, out=np.zeros(reciprocal.shape), where=~parallel)
+
+    # (nearly) parallel lines: distance of the points closest to the origin
+    if np.any(parallel):
+        ia, ib = np.nonzero(parallel)
+        ra = np.cross(na[ia], ma[ia])
+        rb = np.cross(nb[ib], mb[ib])
+        dist[ia, ib] = np.linalg.norm(ra - rb, axis=1)
+
+    return dist, ang
+
+def iterAxisDistanceBlocks(La, Lb=None, block_size=2048):
+    """
+    Yields the pairwise distance/angle matrix of La x Lb (Lb = La if not given)
+    block by block as (row_start, col_start, dist_block, ang_block).
+    Each block is at most block_size x block_size, so the full matrix is
+    never built at once.
+    """
+    if Lb is None:
+        Lb = La
+    for i0 in range(0, La.shape[0], block_size):
+        La_block = np.asarray(La[i0:i0+block_size], dtype=np.float64)
+        for j0 in range(0, Lb.shape[0], block_size):
+            Lb_block = np.asarray(Lb[j0:j0+block_size], dtype=np.float64)
+            dist, ang = axisDistances(La_block, Lb_block)
+            yield i0, j0, dist, ang
+
+def axisDistanceMatrix(La, Lb=None, block_size=2048, dtype=np.float32, out_dist=None, out_ang=None):
+    """
+    Full pairwise distance and angle matrices of La x Lb, computed in blocks.
+    The results are stored as dtype (float32 by default). out_dist/out_ang
+    can be preallocated arrays, e.g. np.memmap files for very large sets.
+    """
+    if Lb is None:
+        Lb = La
+    shape = (La.shape[0], Lb.shape[0])
+    if out_dist is None:
+        out_dist = np.empty(shape, dtype=dtype)
+    if out_ang is None:
+        out_ang = np.empty(shape, dtype=dtype)
+
+    for i0, j0, dist, ang in iterAxisDistanceBlocks(La, Lb, block_size):
+        out_dist[i0:i0+dist.shape[0], j0:j0+dist.shape[1]] = dist
+        out_ang[i0:i0+ang.shape[0], j0:j0+ang.shape[1]] = ang
+
+    return out_dist, out_ang
+
+
+class gridIndex():
+    """
+    Uniform grid over 3D points (finite) with cell size radius.
+    All pairs within radius are found by looking only into the 27 neighboring
+    cells of every point, which is sub-quadratic for spread-out points.
+    Only occupied cells are stored, keyed on the ranks of their coordinates
+    among the occupied coordinates per dimension, so the memory does not
+    depend on the extent of the points.
+    """
+    def __init__(self, points, radius):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.radius = radius
+        self.cells = np.floor(self.points / radius).astype(np.int64)
+
+        # occupied coordinates per dimension, occupied cells, points sorted by cell
+        self.coords = [np.unique(self.cells[:,d]) for d in range(3)]
+        keys, _ = self.__cellKeys(self.cells)
+        self.occupied, cell_ids = np.unique(keys, return_inverse=True)
+        cell_ids = cell_ids.ravel()
+        self.order = np.argsort(cell_ids, kind='stable')
+        self.cell_count = np.bincount(cell_ids, minlength=self.occupied.shape[0])
+        self.cell_start = np.cumsum(self.cell_count) - self.cell_count
+
+    def __cellKeys(self, cells):
+        """
+        Returns the key of every cell and whether all its coordinates are occupied.
+        """
+        keys = np.zeros(cells.shape[0], dtype=np.int64)
+        found = np.ones(cells.shape[0], dtype=bool)
+        for d in range(3):
+            rank = np.minimum(np.searchsorted(self.coords[d], cells[:,d]), self.coords[d].shape[0] - 1)
+            found &= self.coords[d][rank] == cells[:,d]
+            keys = keys * self.coords[d].shape[0] + rank
+        return keys, found
+
+    def __lookupCells(self, cells):
+        """
+        Returns the index of every cell in self.occupied and whether it is occupied.
+        """
+        keys, found = self.__cellKeys(cells)
+        pos = np.minimum(np.searchsorted(self.occupied, keys), self.occupied.shape[0] - 1)
+        return pos, found & (self.occupied[pos] == keys)
+
+    def queryPairs(self, chunk_size=4096):
+        """
+        Yields all pairs (i, j) with |p_i - p_j| <= radius (including i == j),
+        in chunks of chunk_size query points i.
+        """
+        return self.queryPoints(self.points, chunk_size)
+
+    def queryPoints(self, query, chunk_size=4096):
+        """
+        Yields all pairs (i, j) of query points (M,3) and points with
+        |q_i - p_j| <= radius, in chunks of chunk_size query points i.
+        """
+        if self.points.shape[0] == 0:
+            return
+        query = np.asarray(query, dtype=np.float64)
+        query_cells = np.floor(query / self.radius).astype(np.int64)
+        for c0 in range(0, query.shape[0], chunk_size):
+            idx = np.arange(c0, min(c0 + chunk_size, query.shape[0]))
+            pairs_i, pairs_j = [], []
+            for offset in product((-1, 0, 1), repeat=3):
+                cell, occupied = self.__lookupCells(query_cells[idx] + offset)
+                start = self.cell_start[cell]
+                counts = np.where(occupied, self.cell_count[cell], 0)
+
+                # expand the ranges [start, start+count) of every query point
+                i = np.repeat(idx, counts)
+                pos = np.arange(i.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+                j = self.order[np.repeat(start, counts) + pos]
+                pairs_i.append(i)
+                pairs_j.append(j)
+
+            i = np.concatenate(pairs_i)
+            j = np.concatenate(pairs_j)
+            close = np.sum((query[i] - self.points[j])**2, axis=1) <= self.radius**2
+            yield i[close], j[close]
+
+def closestPoints(n, s, c):
+    """
+    Points of the axes (n, s) closest to the point c.
+    """
+    return s + np.sum((c - s) * n, axis=1)[:,None] * n
+
+def pivotPoint(n, s):
+    """
+    Optimal pivot point of a set of axes (Stokdijk et al 1999), i.e. the point
+    with the least squared distance to all axes (unit n).
+    """
+    Q = np.eye(3) - np.einsum('ij,ik->ijk', n, n)
+    return np.linalg.lstsq(np.sum(Q, axis=0), np.sum(Q @ s[:,:,None], axis=0), rcond=None)[0].reshape(3)
+
+def canonicalDirections(n):
+    """
+    Flips the directions n (N,3) so that their largest-magnitude component is
+    positive. n and -n describe the same axis line.
+    """
+    n = np.asarray(n, dtype=np.float64)
+    largest = n[np.arange(n.shape[0]), np.argmax(np.abs(n), axis=1)]
+    return n * np.where(largest < 0, -1.0, 1.0)[:,None]
+
+def groupByCell(cell_ids, nr_cells, mask=None):
+    """
+    Groups points by their cell id, optionally only the points in mask.
+    Returns (order, start, count): the points of cell c are order[start[c]:start[c]+count[c]].
+    """
+    idx = np.arange(cell_ids.shape[0]) if mask is None else np.nonzero(mask)[0]
+    order = idx[np.argsort(cell_ids[idx], kind='stable')]
+    count = np.bincount(cell_ids[idx], minlength=nr_cells)
+    return order, np.cumsum(count) - count, count
+
+def iterCellPairPoints(cell_a, cell_b, group_a, group_b, max_pairs=2**22):
+    """
+    Yields all point pairs (i, j) of the cell pairs (cell_a, cell_b), i from
+    group_a and j from group_b (see groupByCell), in chunks of about max_pairs.
+    """
+    order_a, start_a, count_a = group_a
+    order_b, start_b, count_b = group_b
+    nr_b = count_b[cell_b]
+    sizes = count_a[cell_a] * nr_b
+    ends = np.cumsum(sizes)
+    k0 = 0
+    while k0 < sizes.shape[0]:
+        if sizes[k0] > max_pairs:
+            # split a large cell pair into blocks of points of cell_a
+            a, b = cell_a[k0], cell_b[k0]
+            j = order_b[start_b[b]:start_b[b]+count_b[b]]
+            block = max(1, max_pairs // j.shape[0])
+            for i0 in range(start_a[a], start_a[a] + count_a[a], block):
+                i = order_a[i0:min(i0 + block, start_a[a] + count_a[a])]
+                yield np.repeat(i, j.shape[0]), np.tile(j, i.shape[0])
+            k0 += 1
+            continue
+        offset = ends[k0] - sizes[k0]
+        k1 = max(k0 + 1, np.searchsorted(ends, offset + max_pairs, side='right'))
+        k = np.repeat(np.arange(k0, k1), sizes[k0:k1])
+        local = np.arange(k.shape[0]) + offset - np.repeat(ends[k0:k1] - sizes[k0:k1], sizes[k0:k1])
+        yield order_a[start_a[cell_a[k]] + local // nr_b[k]], order_b[start_b[cell_b[k]] + local % nr_b[k]]
+        k0 = k1
+
+def densityClusters(points, n, eps_dist, eps_ang, min_samples, chunk_size=4096, max_pairs=2**22):
+    """
+    DBSCAN of axes given by their points at the joint center (N,3) and unit
+    directions n (N,3), see clusterAxes. The axes are grouped into cells over
+    the points and the canonical directions (see canonicalDirections), small
+    enough that all axes of one cell are neighbors. Cells with at least
+    min_samples axes (dense) are core as a whole and their point pairs are
+    never listed: dense cells are merged at cell level with a union-find,
+    closest first and only if not merged yet. The axes of the other cells
+    query their neighbors once, among each other with a gridIndex and in the
+    dense cells that can hold neighbors, in chunks of about max_pairs. So a
+    dense dominant axis costs about linear time.
+
+    Returns the cluster root per axis (-1 for noise) and the core mask.
+    """
+    nr_axes = points.shape[0]
+    cos_min = np.cos(eps_ang)
+
+    def neighbors(i, j):
+        return ((np.sum((points[i] - points[j])**2, axis=1) <= eps_dist**2) &
+                (np.abs(np.sum(n[i] * n[j], axis=1)) >= cos_min))
+
+    def directionGap2(a, b):
+        return np.minimum(np.sum((a - b)**2, axis=1), np.sum((a + b)**2, axis=1))
+
+    # cells with a diagonal of eps_dist (points) and of the chord of eps_ang (directions)
+    chord = 2 * np.sin(eps_ang / 2)
+    cell_size = np.repeat([eps_dist, chord], 3) * (1 - 1e-9) / np.sqrt(3)
+    cells = np.floor(np.hstack((points, canonicalDirections(n))) / cell_size).astype(np.int64)
+    _, cell_first, cell_ids = np.unique(cells, axis=0, return_index=True, return_inverse=True)
+    cell_ids = cell_ids.ravel()
+    nr_cells = cell_first.shape[0]
+    members = groupByCell(cell_ids, nr_cells)
+    dense = members[2] >= min_samples
+    core = dense[cell_ids]
+    dense_cells = np.nonzero(dense)[0]
+    centers = (cells[cell_first[dense_cells]] + 0.5) * cell_size
+    dense_index = gridIndex(centers[:,0:3], 2 * eps_dist)
+
+    # neighbor pairs of the axes of sparse cells: among each other, and with the
+    # axes of dense cells with centers within 1.5 eps_dist and 1.5 chords
+    sparse = np.nonzero(~core)[0]
+    pairs_i, pairs_j = [], []
+    for i, j in gridIndex(points[sparse], eps_dist).queryPairs(chunk_size):
+        close = neighbors(sparse[i], sparse[j])
+        pairs_i.append(sparse[i[close]])
+        pairs_j.append(sparse[j[close]])
+    single = (np.arange(nr_axes), np.arange(nr_axes), np.ones(nr_axes, dtype=np.int64))
+    for q, c in dense_index.queryPoints(points[sparse], chunk_size):
+        q = sparse[q]
+        reach = ((np.sum((points[q] - centers[c,0:3])**2, axis=1) <= (1.5 * eps_dist)**2) &
+                 (directionGap2(n[q], centers[c,3:6]) <= (1.5 * chord)**2))
+        for i, j in iterCellPairPoints(q[reach], dense_cells[c[reach]], single, members, max_pairs):
+            close = neighbors(i, j)
+            pairs_i.append(i[close])
+            pairs_j.append(j[close])
+    pairs_i = np.concatenate(pairs_i) if pairs_i else np.zeros(0, dtype=np.int64)
+    pairs_j = np.concatenate(pairs_j) if pairs_j else np.zeros(0, dtype=np.int64)
+
+    # core axes have at least min_samples neighbors (including themselves)
+    core |= np.bincount(pairs_i, minlength=nr_axes) >= min_samples
+
+    parent = list(range(nr_cells))
+
+    def find(c):
+        while parent[c] != c:
+            parent[c] = parent[parent[c]]
+            c = parent[c]
+        return c
+
+    def union(ra, rb):
+        parent[max(ra, rb)] = min(ra, rb)
+
+    # union-find over the cells: core pairs of the sparse axes
+    linked = core[pairs_i] & core[pairs_j] & (cell_ids[pairs_i] < cell_ids[pairs_j])
+    links = np.unique(cell_ids[pairs_i[linked]] * nr_cells + cell_ids[pairs_j[linked]])
+    for a, b in zip((links // nr_cells).tolist(), (links % nr_cells).tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            union(ra, rb)
+
+    # dense cells with centers within 2 eps_dist and 2 chords are merged if any of
+    # their axes are neighbors, closest first, cells already merged are not tested
+    for a, b in dense_index.queryPairs(chunk_size):
+        gap2 = directionGap2(centers[a,3:6], centers[b,3:6])
+        close = np.nonzero((a < b) & (gap2 <= (2 * chord)**2))[0]
+        gap = np.sum(((centers[a[close],0:3] - centers[b[close],0:3]) / eps_dist)**2, axis=1) + gap2[close] / chord**2
+        close = close[np.argsort(gap, kind='stable')]
+        for ca, cb in zip(dense_cells[a[close]].tolist(), dense_cells[b[close]].tolist()):
+            ra, rb = find(ca), find(cb)
+            if ra == rb:
+                continue
+            for i, j in iterCellPairPoints(np.array([ca]), np.array([cb]), members, members, max_pairs):
+                if np.any(neighbors(i, j)):
+                    union(ra, rb)
+                    break
+    root = np.array([find(c) for c in range(nr_cells)])
+
+    # border axes (all in sparse cells) join the cluster of a neighboring core axis
+    cluster_root = np.where(core, root[cell_ids], -1)
+    border = ~core[pairs_i] & core[pairs_j]
+    cluster_root[pairs_i[border]] = root[cell_ids[pairs_j[border]]]
+
+    return cluster_root, core
+
+def clusterAxes(n, r0, eps_dist, eps_ang, min_samples=10, center=None, phi=None, min_phi=0.1,
+                max_axes=None, chunk_size=4096):
+    """
+    Density-based clustering (DBSCAN) of a set of axes, e.g. the FHAs of
+    a multi-cycle recording, to find the dominant joint axes.
+    Two axes are neighbors if their distance at the joint center is at most
+    eps_dist and their angle (folded to [0,pi/2]) is at most eps_ang (rad).
+    The distance at the joint center is measured between the axis points
+    closest to center (default: the pivot point of the axes, refit without
+    axes further than 3x the median distance from it); it bounds the
+    line distance from above but ignores crossings far away from the joint.
+    See densityClusters for the neighbor queries.
+    Undefined axes (n = 0), non-finite axes and, if phi is given, axes with
+    |phi| <= min_phi * max(|phi|) are noise. With little rotation the axis
+    location is not reliable and can be arbitrarily far away.
+    If there are more than max_axes usable axes, only every k-th of them is
+    clustered (with min_samples / k), which bounds the time, e.g. in the GUI.
+    The others join the cluster of the previous or next clustered axis if
+    that is a neighboring core axis (consecutive axes of a motion are
+    usually close), otherwise they are noise.
+
+    Returns:
+      - labels: (N,) cluster index per axis, -1 for noise
+      - representatives: (K,6) [n, r0] average axis of each cluster,
+        r0 closest to the origin
+    """
+    nr_axes = n.shape[0]
+    n = np.asarray(n, dtype=np.float64)
+    r0 = np.asarray(r0, dtype=np.float64)
+    length = np.linalg.norm(n, axis=1)
+    usable = (length > 0) & np.all(np.isfinite(n), axis=1) & np.all(np.isfinite(r0), axis=1)
+    if phi is not None:
+        phi_abs = np.abs(np.asarray(phi, dtype=np.float64))
+        usable &= np.isfinite(phi_abs)
+        usable &= phi_abs > min_phi * np.max(phi_abs[usable], initial=0.0)
+    valid = np.nonzero(usable)[0]
+    n = n[valid] / length[valid,None]
+    r0 = r0[valid]
+    nr_valid = valid.shape[0]
+
+    labels = np.full(nr_axes, -1)
+    if nr_valid == 0:
+        return labels, np.zeros((0,6))
+
+    if center is None:
+        # refit without axes far from the first pivot, they would drag it off the joint
+        center = pivotPoint(n, r0)
+        dist = np.linalg.norm(np.cross(center - r0, n), axis=1)
+        inliers = dist <= 3 * np.median(dist)
+        center = pivotPoint(n[inliers], r0[inliers])
+    points = closestPoints(n, r0, center)
+
+    if max_axes is None or nr_valid <= max_axes:
+        cluster_root, _ = densityClusters(points, n, eps_dist, eps_ang, min_samples, chunk_size)
+    else:
+        stride = int(np.ceil(nr_valid / max_axes))
+        sampled_root, sampled_core = densityClusters(points[::stride], n[::stride], eps_dist, eps_ang,
+                                                     int(np.ceil(min_samples / stride)), chunk_size)
+        cluster_root = np.full(nr_valid, -1)
+        cluster_root[::stride] = sampled_root
+        others = np.nonzero(np.arange(nr_valid) % stride)[0]
+        for sampled in (np.minimum(others // stride + 1, sampled_root.shape[0] - 1), others // stride):
+            # next, then previous clustered axis (the previous one wins)
+            close = sampled_core[sampled]
+            close[close] = ((np.sum((points[others[close]] - points[sampled[close] * stride])**2, axis=1) <= eps_dist**2) &
+                            (np.abs(np.sum(n[others[close]] * n[sampled[close] * stride], axis=1)) >= np.cos(eps_ang)))
+            cluster_root[others[close]] = sampled_root[sampled[close]]
+
+    # relabel roots to 0..K-1 in order of appearance
+    clustered = cluster_root >= 0
+    roots, first = np.unique(cluster_root[clustered], return_index=True)
+    rank = np.empty(roots.shape[0], dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(roots.shape[0])
+    valid_labels = np.full(nr_valid, -1)
+    valid_labels[clustered] = rank[np.searchsorted(roots, cluster_root[clustered])]
+    labels[valid] = valid_labels
+
+    # representative axis: dominant direction, through the mean of the points at the joint center
+    representatives = np.zeros((roots.shape[0], 6))
+    for k in range(roots.shape[0]):
+        members = valid_labels == k
+        U, _, _ = np.linalg.svd(n[members].T @ n[members])
+        n_rep = U[:,0] * np.sign(np.sum(n[members] @ U[:,0]) or 1.0)
+        s_rep = np.mean(points[members], axis=0)
+        representatives[k,0:3] = n_rep
+        representatives[k,3:6] = s_rep - np.dot(s_rep, n_rep) * n_rep
+
+    return labels, representatives
+
+
+class kdTree():
+    """
+    Static k-d tree over points (N,D) for k-nearest and radius queries
+    in O(log N) (Euclidean metric). Nodes are kept in flat arrays, every
+    node holds the bounding box of its points for pruning.
+    """
+    def __init__(self, points, leaf_size=16):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.leaf_size = leaf_size
+        self.order = np.arange(self.points.shape[0])
+
+        # per node: range in order, children (-1 for leaves), bounding box
+        start, end, left, right, lo, hi = [], [], [], [], [], []
+        stack = [(0, self.points.shape[0], -1, 0)]
+        while stack:
+            s, e, parent, side = stack.pop()
+            node = len(start)
+            if parent >= 0:
+                (left if side == 0 else right)[parent] = node
+            p = self.points[self.order[s:e]]
+            start.append(s)
+            end.append(e)
+            left.append(-1)
+            right.append(-1)
+            lo.append(p.min(axis=0) if e > s else np.zeros(self.points.shape[1]))
+            hi.append(p.max(axis=0) if e > s else np.zeros(self.points.shape[1]))
+            if e - s <= leaf_size:
+                continue
+
+            # split at the median of the widest dimension
+            dim = np.argmax(hi[node] - lo[node])
+            mid = (e - s) // 2
+            part = np.argpartition(p[:,dim], mid)
+            self.order[s:e] = self.order[s:e][part]
+            stack.append((s + mid, e, node, 1))
+            stack.append((s, s + mid, node, 0))
+
+        self.node_start = np.array(start)
+        self.node_end = np.array(end)
+        self.node_left = np.array(left)
+        self.node_right = np.array(right)
+        self.node_lo = np.array(lo)
+        self.node_hi = np.array(hi)
+
+    def __boxDistance2(self, node, x):
+        d = np.maximum(self.node_lo[node] - x, 0.0) + np.maximum(x - self.node_hi[node], 0.0)
+        return np.dot(d, d)
+
+    def query(self, x, k=1):
+        """
+        Returns the distances and indices of the k points closest to x, closest first.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        k = min(k, self.points.shape[0])
+        best = [] # max-heap of (-dist2, index)
+        nodes = [(0.0, 0)] # min-heap of (box dist2, node)
+        while nodes:
+            box_d2, node = heapq.heappop(nodes)
+            if len(best) == k and box_d2 > -best[0][0]:
+                break
+            if self.node_left[node] < 0:
+                idx = self.order[self.node_start[node]:self.node_end[node]]
+                d2 = np.sum((self.points[idx] - x)**2, axis=1)
+                for dist2, i in zip(d2, idx):
+                    if len(best) < k:
+                        heapq.heappush(best, (-dist2, i))
+                    elif dist2 < -best[0][0]:
+                        heapq.heapreplace(best, (-dist2, i))
+            else:
+                for child in (self.node_left[node], self.node_right[node]):
+                    heapq.heappush(nodes, (self.__boxDistance2(child, x), child))
+
+        best = sorted((-d2, i) for d2, i in best)
+        return np.sqrt([d2 for d2, i in best]), np.array([i for d2, i in best], dtype=np.int64)
+
+    def queryRadius(self, x, radius):
+        """
+        Returns the (sorted) indices of all points within radius of x.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        found = []
+        nodes = [0]
+        while nodes:
+            node = nodes.pop()
+            if self.__boxDistance2(node, x) > radius**2:
+                continue
+            if self.node_left[node] < 0:
+                idx = self.order[self.node_start[node]:self.node_end[node]]
+                found.append(idx[np.sum((self.points[idx] - x)**2, axis=1) <= radius**2])
+            else:
+                nodes.append(self.node_left[node])
+                nodes.append(self.node_right[node])
+
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(found))
+
+def axisFeatures(n, r0, angle_scale):
+    """
+    Embeds axes (n, r0) as points [r0, angle_scale * n] (N,6), with the sign
+    of n made canonical (see canonicalDirections), as n and -n are the same
+    axis line. The Euclidean distance of two points combines the distance of
+    the r0 and the angle of the axes, angle_scale (length per rad) weights the
+    angle against r0 (|dn| ~ angle).
+    """
+    return np.hstack((r0, angle_scale * canonicalDirections(n)))
+
+class axisIndex():
+    """
+    Nearest-axis queries on a set of axes (n, r0), e.g. "which frames have an
+    axis close to this one", see axisFeatures for the metric. The angle is
+    folded like in clusterAxes: queries are run with both signs of the
+    canonical direction, so axes close to the sign flip of canonicalDirections
+    find each other too. Axes through the same point with opposite n (e.g.
+    flexion and extension) are neighbors:
+
+    >>> index = axisIndex(np.array([[0., 0., 1.], [0., 0., -1.], [1., 0., 0.]]), np.zeros((3,3)), 0.03)
+    >>> index.withinRadius(np.array([0., 0., 1.]), np.zeros(3), 0.001)
+    array([0, 1])
+    >>> index.nearest(np.array([0., 0., -1.]), np.zeros(3), 2)[1]
+    array([0, 1])
+
+    Undefined axes (n = 0) are not indexed.
+    """
+    def __init__(self, n, r0, angle_scale, leaf_size=16):
+        n = np.asarray(n, dtype=np.float64)
+        r0 = np.asarray(r0, dtype=np.float64)
+        self.angle_scale = angle_scale
+        self.frames = np.nonzero(np.any(n != 0, axis=1))[0]
+        self.tree = kdTree(axisFeatures(n[self.frames], r0[self.frames], angle_scale), leaf_size)
+
+    def __queryFeatures(self, n, r0):
+        """
+        Features of the axis (n, r0) with both signs of its canonical direction.
+        """
+        x = axisFeatures(np.asarray(n, dtype=np.float64)[None], np.asarray(r0, dtype=np.float64)[None], self.angle_scale)[0]
+        return x, np.concatenate((x[0:3], -x[3:6]))
+
+    def nearest(self, n, r0, k=1):
+        """
+        Returns the distances and frames of the k axes closest to the axis (n, r0).
+        """
+        if self.frames.shape[0] == 0:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        results = [self.tree.query(x, k) for x in self.__queryFeatures(n, r0)]
+        dist = np.concatenate([d for d, _ in results])
+        idx = np.concatenate([i for _, i in results])
+
+        # axes found with both signs keep the smaller distance
+        order = np.lexsort((dist, idx))
+        first = np.ones(order.shape[0], dtype=bool)
+        first[1:] = idx[order[1:]] != idx[order[:-1]]
+        best = order[first]
+        best = best[np.argsort(dist[best], kind='stable')][:k]
+        return dist[best], self.frames[idx[best]]
+
+    def withinRadius(self, n, r0, radius):
+        """
+        Returns the (sorted) frames of all axes within radius of the axis (n, r0).
+        """
+        if self.frames.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64)
+        idx = np.unique(np.concatenate([self.tree.queryRadius(x, radius) for x in self.__queryFeatures(n, r0)]))
+        return self.frames[idx]
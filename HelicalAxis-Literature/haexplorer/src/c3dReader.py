@@ -0,0 +1,222 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021 Pepe Eulzer. All rights reserved.
+# Distributed under the (new) BSD License.
+# -----------------------------------------------------------------------------
+
+import os
+
+import numpy as np
+
+# file next to the .c3d (or in the folder above) that assigns marker labels to objects
+MARKER_CONFIG_NAME = "c3d_markers.txt"
+
+# conversion of POINT:UNITS to m
+UNIT_SCALES = {'mm': 0.001, 'cm': 0.01, 'm': 1.0}
+
+
+class c3dFile():
+    """
+    Minimal C3D reader (Intel, DEC and MIPS processor formats).
+    Parses the header and the parameter section, the point block is
+    memory-mapped and only read when marker trajectories are requested.
+    Parameters are stored as dict "GROUP:PARAMETER" -> value.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(512)
+            param_start = (header[0] - 1) * 512
+            f.seek(param_start)
+            param_header = f.read(4)
+            f.seek(param_start)
+            param_section = f.read(max(param_header[2], 1) * 512)
+
+        # processor type: 84 Intel, 85 DEC, 86 MIPS (big endian)
+        self.processor = param_header[3] - 83
+        self.endian = '>' if self.processor == 3 else '<'
+
+        words = np.frombuffer(header, dtype=self.endian + 'i2', count=12)
+        self.nr_points = int(words[1])
+        self.nr_analog = int(words[2]) # analog values per frame
+        first_frame = int(words[3]) & 0xFFFF
+        last_frame = int(words[4]) & 0xFFFF
+        self.scale = float(self.__floats(header[12:16])[0])
+        data_start = int(words[8]) & 0xFFFF
+        self.frame_rate = float(self.__floats(header[20:24])[0])
+
+        self.parameters = self.__parseParameters(param_section)
+        self.nr_frames = last_frame - first_frame + 1
+        if 'POINT:LONG_FRAMES' in self.parameters:
+            # frame count as float, written for trials with more than 65535 frames
+            self.nr_frames = int(np.ravel(self.parameters['POINT:LONG_FRAMES'])[0])
+        elif 'POINT:FRAMES' in self.parameters:
+            # header frame numbers are limited to 16 bit
+            self.nr_frames = max(self.nr_frames, unsignedParameter(self.parameters['POINT:FRAMES']))
+        if 'POINT:DATA_START' in self.parameters:
+            data_start = unsignedParameter(self.parameters['POINT:DATA_START'])
+
+        labels = list(self.parameters.get('POINT:LABELS', []))
+        labels += list(self.parameters.get('POINT:LABELS2', []))
+        self.labels = [l.strip() for l in labels[:self.nr_points]]
+        self.units = str(self.parameters.get('POINT:UNITS', 'mm')).strip()
+
+        # one record per frame: points (x, y, z, residual) followed by analog values
+        # float data for negative scale factors, scaled int16 otherwise
+        if self.scale < 0:
+            value_type = self.endian + ('u2' if self.processor == 2 else 'f4')
+            value_count = 2 if self.processor == 2 else 1
+        else:
+            value_type = self.endian + 'i2'
+            value_count = 1
+        self.frame_type = np.dtype([('points', value_type, (self.nr_points, 4 * value_count)),
+                                    ('analog', value_type, (self.nr_analog * value_count,))])
+        file_size = os.path.getsize(path)
+        offset = (data_start - 1) * 512
+        self.nr_frames = min(self.nr_frames, (file_size - offset) // self.frame_type.itemsize)
+        self.frames = np.memmap(path, dtype=self.frame_type, mode='r', offset=offset, shape=(self.nr_frames,))
+
+    def __floats(self, raw):
+        """
+        Converts raw bytes to float32 values in the processor format of the file.
+        """
+        if self.processor == 2:
+            # DEC: swap the 16 bit words, the exponent is off by 2
+            swapped = np.frombuffer(raw, dtype='<u2').reshape(-1, 2)[:,::-1].copy()
+            return swapped.view('<f4').ravel() / 4.0
+        return np.frombuffer(raw, dtype=self.endian + 'f4')
+
+    def __parseParameters(self, section):
+        groups = {}
+        parameters = []
+        pos = 4
+        while pos + 2 <= len(section):
+            name_length = abs(int(np.frombuffer(section, dtype='i1', count=1, offset=pos)[0]))
+            group_id = int(np.frombuffer(section, dtype='i1', count=1, offset=pos+1)[0])
+            if name_length == 0:
+                break
+            name = section[pos+2:pos+2+name_length].decode('ascii', 'replace').upper()
+            q = pos + 2 + name_length
+            next_offset = int(np.frombuffer(section, dtype=self.endian + 'i2', count=1, offset=q)[0])
+
+            if group_id < 0:
+                groups[-group_id] = name
+            else:
+                data_type = int(np.frombuffer(section, dtype='i1', count=1, offset=q+2)[0])
+                nr_dims = section[q+3]
+                dims = tuple(section[q+4:q+4+nr_dims])
+                size = abs(data_type) * int(np.prod(dims))
+                raw = section[q+4+nr_dims:q+4+nr_dims+size]
+                parameters.append((group_id, name, self.__parameterValue(data_type, dims, raw)))
+
+            if next_offset == 0:
+                break
+            pos = q + next_offset
+
+        return {groups.get(group_id, str(group_id)) + ":" + name: value
+                for group_id, name, value in parameters}
+
+    def __parameterValue(self, data_type, dims, raw):
+        # dimensions are stored in column-major order
+        if data_type == -1:
+            if len(dims) <= 1:
+                return raw.decode('ascii', 'replace')
+            length = dims[0]
+            return [raw[i:i+length].decode('ascii', 'replace') for i in range(0, len(raw), length)]
+        if data_type == 1:
+            values = np.frombuffer(raw, dtype='u1')
+        elif data_type == 2:
+            values = np.frombuffer(raw, dtype=self.endian + 'i2')
+        else:
+            values = self.__floats(raw)
+        if len(dims) == 0:
+            return values[0]
+        return values.reshape(dims[::-1])
+
+    def labelIndices(self, labels):
+        """
+        Returns the point indices of the given marker labels.
+        Labels match exactly or after a "Subject:" prefix.
+        """
+        indices = []
+        for label in labels:
+            matches = [i for i, l in enumerate(self.labels) if l == label or l.split(":")[-1] == label]
+            if not matches:
+                raise KeyError("c3dFile: marker " + label + " not found in " + self.path)
+            indices.append(matches[0])
+        return indices
+
+    def markerTrajectories(self, labels):
+        """
+        Returns the trajectories of the given markers with shape (T,m,3) in m.
+        Invalid (occluded) samples are NaN.
+        """
+        points = np.asarray(self.frames['points'][:, self.labelIndices(labels)])
+        if self.scale < 0:
+            if self.processor == 2:
+                points = self.__floats(points.tobytes()).reshape(points.shape[0], points.shape[1], 4)
+            points = points.astype(np.float64)
+            xyz = points[:,:,0:3]
+            residual = points[:,:,3]
+        else:
+            xyz = points[:,:,0:3] * abs(self.scale)
+            residual = points[:,:,3].astype(np.float64)
+
+        xyz = xyz * UNIT_SCALES.get(self.units.lower(), 1.0)
+        xyz[residual < 0] = np.nan
+        return xyz
+
+
+class c3dMotion():
+    """
+    Motion source of one object in a .c3d trial, see conversions.motionFiles.
+    Holds the marker labels of the object and optionally the marker
+    positions in object coordinates (m,3).
+    """
+    def __init__(self, path, name, labels, reference=None):
+        self.path = path
+        self.name = name
+        self.labels = labels
+        self.reference = reference
+
+
+def unsignedParameter(value):
+    """
+    Integer value of a count parameter. Counts stored as int16 above 32767
+    are negative and are reinterpreted as unsigned, float values are kept.
+    """
+    value = int(np.ravel(value)[0])
+    return value + 65536 if value < 0 else value
+
+def loadMarkerConfig(path):
+    """
+    Reads a marker config: one line per object with the object name
+    followed by its (>= 3) marker labels, e.g.
+      radius RSP RAD1 RAD2
+    An optional line <name>_ref lists the marker positions in object
+    coordinates (x y z per marker). Without it, the first frame where
+    all markers are visible is the reference.
+    Returns a dict name -> (labels, reference or None).
+    """
+    config = {}
+    references = {}
+    with open(path) as f:
+        for l in f.readlines():
+            entries = l.split()
+            if len(entries) == 0 or entries[0].startswith("#"):
+                continue
+            if entries[0].endswith("_ref"):
+                references[entries[0][:-4]] = np.array(entries[1:], dtype=np.float64).reshape(-1, 3)
+            else:
+                config[entries[0]] = entries[1:]
+    return {name: (labels, references.get(name)) for name, labels in config.items()}
+
+def findMarkerConfig(c3d_path):
+    """
+    Returns the path of the marker config next to c3d_path or in the folder above, or None.
+    """
+    head = os.path.dirname(os.path.abspath(c3d_path))
+    for folder in (head, os.path.dirname(head)):
+        path = os.path.join(folder, MARKER_CONFIG_NAME)
+        if os.path.exists(path):
+            return path
+    return None
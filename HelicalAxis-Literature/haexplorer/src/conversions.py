@@ -4,62 +4,299 @@
 # -----------------------------------------------------------------------------
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
 import numpy as np
 
-def markerToRv(marker_path):
+import c3dReader
+import fileCache
+import matLoader
+
+def markerToRv(marker_path, force=False):
     """
     Converts a list of marker positions to a list of model transformations R, v.
-    Caches the _rot.txt and _pos.txt files.
+    Caches them as binary _pose.npy file (see loadPoses).
     The first row in the list of marker positions describe the locations
     in object coordinates. All further rows are interpreted as timesteps (world coordinates).
     Note that |markers| >= 3.
+    The conversion is skipped if the marker file did not change since the last
+    conversion (same path, size and mtime), unless force is set.
+    Returns the RMS marker residual of the fit per timestep, or None if skipped.
     """
-    markers = np.loadtxt(marker_path, dtype=np.float32, comments="#")
-
-    # get number of markers, reshape
-    n_markers = int(markers.shape[1] / 3)
-    n_timesteps = int(markers.shape[0] - 1)
-    if n_markers*3 != markers.shape[1]:
-        print("markerToRv: Columns not divisible by 3. Each marker must be given as x y z.")
-    markers = markers.reshape(-1, n_markers, 3)
-    
-    # first row is reference frame
-    M0 = markers[0]
-    M0_centroid = np.mean(M0, axis=0)
-    markers = markers[1:]
-
-    rot = np.zeros((n_timesteps, 9), dtype=np.float32)
-    pos = np.zeros((n_timesteps, 3), dtype=np.float32)
-    for i in range(n_timesteps):
-        # transformation of M0 -> M1 using the Kabsch algorithm
-        M1 = markers[i]
-        M1_centroid = np.mean(M1, axis=0)
-
-        # covariance matrix -> svd -> least squares rotation
-        H = (M0 - M0_centroid).T @ (M1 - M1_centroid)
-        U,_,V = np.linalg.svd(H)
-        V = V.T # numpy nonsense (seriously, why?)
-        S = np.eye(3) # check to ensure a right-hand system
-        S[2,2] = np.sign(np.linalg.det(V@U.T))
-        R = V @ S @ U.T
-
-        # translation
-        v = M1_centroid - R @ M0_centroid
-
-        rot[i] = R.reshape(9)
-        pos[i] = v
-
-    head, tail = os.path.split(marker_path)
+    pose_path, key_path = markerPosePaths(marker_path)
+    key = fileCache.fileKey(marker_path)
+    if not force and os.path.exists(pose_path) and fileCache.readKey(key_path) == key:
+        return None
+
+    # stream the marker rows into the solver, batch by batch
+    # the first row is the reference frame
+    M0 = None
+    pose, rms = [], []
+    for batch in iterMarkerRows(marker_path, dtype=np.float32):
+        # get number of markers, reshape
+        n_markers = int(batch.shape[1] / 3)
+        if n_markers*3 != batch.shape[1]:
+            print("markerToRv: Columns not divisible by 3. Each marker must be given as x y z.")
+        batch = batch.reshape(-1, n_markers, 3)
+        if M0 is None:
+            M0, batch = batch[0], batch[1:]
+        R, v, batch_rms = kabsch(M0, batch)
+
+        # one row per timestep: rotation (row-major) | translation
+        pose.append(np.hstack((R.reshape(-1, 9), v)).astype(np.float32))
+        rms.append(batch_rms)
+    pose = np.concatenate(pose)
+    rms = np.concatenate(rms)
+    np.save(pose_path + ".tmp.npy", pose)
+    try:
+        os.replace(pose_path + ".tmp.npy", pose_path)
+    except OSError:
+        # the previous poses are still memory-mapped (loadPoses), which blocks the replace on Windows
+        # keep them and leave the key stale, so the conversion is repeated on the next load
+        os.remove(pose_path + ".tmp.npy")
+        print("markerToRv: " + pose_path + " is in use, the previous poses are kept until the next load.")
+        return rms
+    fileCache.writeKey(key_path, key)
+
+    return rms
+
+def markerPosePaths(marker_path):
+    """
+    Returns the path of the _pose.npy file written by markerToRv and of its cache key.
+    """
+    head, tail = os.path.split(os.path.abspath(marker_path))
     object_name = tail.split('_')[0]
-    rot_path = head + "/" + object_name + "_rot.txt"
-    pos_path = head + "/" + object_name + "_pos.txt"
-    np.savetxt(rot_path, rot)
-    np.savetxt(pos_path, pos)
+    return head + "/" + object_name + "_pose.npy", head + "/.cache/" + tail + ".key"
+
+def markerPoseCurrent(marker_path):
+    """
+    True if the _pose.npy file of marker_path exists and the marker file did not change since.
+    """
+    pose_path, key_path = markerPosePaths(marker_path)
+    return os.path.exists(pose_path) and fileCache.readKey(key_path) == fileCache.fileKey(marker_path)
+
+def readMarkerHeader(marker_path):
+    """
+    Parses the Octave-style header of a marker file, i.e. the leading lines
+    "# key: value" (name, type, rows, columns, ...).
+    Returns a dict of the header entries (rows and columns as int, if given)
+    and the byte offset of the first data line.
+    """
+    header = {}
+    offset = 0
+    with open(marker_path, "rb") as f:
+        for line in f:
+            stripped = line.strip()
+            if stripped and not stripped.startswith(b"#"):
+                break
+            offset += len(line)
+            key, sep, value = stripped[1:].decode().partition(":")
+            if sep:
+                header[key.strip()] = value.strip()
+    for key in ("rows", "columns"):
+        if key in header:
+            header[key] = int(header[key].split()[0])
+    return header, offset
+
+def iterMarkerRows(marker_path, batch_size=4096, chunk_size=2**22, dtype=np.float64):
+    """
+    Reads the rows of a whitespace separated marker file (with optional
+    Octave header, see readMarkerHeader) in batches of batch_size rows.
+    The text is parsed in blocks of chunk_size bytes instead of at once,
+    so only one block and one batch are held in memory.
+    Yields arrays of shape (<=batch_size, columns).
+    """
+    header, offset = readMarkerHeader(marker_path)
+    pending = None
+    with open(marker_path, "rb") as f:
+        f.seek(offset)
+        rest = b""
+        while True:
+            chunk = f.read(chunk_size)
+            block = rest + chunk
+            # parse complete lines only
+            cut = block.rfind(b"\n") + 1 if chunk else len(block)
+            block, rest = block[:cut], block[cut:]
+            lines = [l for l in block.split(b"\n") if l.strip() and not l.lstrip().startswith(b"#")]
+
+            if lines:
+                rows = np.loadtxt(lines, dtype=dtype, ndmin=2)
+                pending = rows if pending is None else np.concatenate((pending, rows))
+                while pending.shape[0] >= batch_size:
+                    yield pending[:batch_size]
+                    pending = pending[batch_size:]
+            if not chunk:
+                break
+    if pending is not None and pending.shape[0]:
+        yield pending
+
+def readMarkers(marker_path, chunk_size=2**22, dtype=np.float64):
+    """
+    Reads a whole marker file as array (rows, columns), see iterMarkerRows.
+    The array is preallocated from the "# rows" and "# columns" header entries.
+    """
+    header, _ = readMarkerHeader(marker_path)
+    if "rows" not in header or "columns" not in header:
+        return np.concatenate(list(iterMarkerRows(marker_path, 2**16, chunk_size, dtype)))
+
+    markers = np.empty((header["rows"], header["columns"]), dtype=dtype)
+    row = 0
+    for batch in iterMarkerRows(marker_path, 2**16, chunk_size, dtype):
+        markers[row:row+batch.shape[0]] = batch
+        row += batch.shape[0]
+    return markers[:row]
+
+def markerFolderToRv(motion_path, max_workers=None, force=False):
+    """
+    Converts all *_marker.txt files in motion_path with markerToRv,
+    spread over a pool of worker processes. Unchanged files are skipped
+    without starting the pool, so this is cheap to call on every load.
+    Returns the results of markerToRv per file (sorted by name).
+    """
+    marker_names = sorted(glob(motion_path + "/*marker.txt"))
+    results = [None] * len(marker_names)
+    stale = [i for i, name in enumerate(marker_names) if force or not markerPoseCurrent(name)]
+    if len(stale) <= 1 or max_workers == 0:
+        for i in stale:
+            results[i] = markerToRv(marker_names[i], force)
+        return results
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for i, rms in zip(stale, executor.map(markerToRv, [marker_names[i] for i in stale], [force] * len(stale))):
+            results[i] = rms
+    return results
+
+def c3dToRv(source):
+    """
+    Converts the marker trajectories of one object in a .c3d trial (c3dReader.c3dMotion)
+    to model transformations R, v, without intermediate files.
+    The reference (object coordinates) is source.reference or, if not given,
+    the first frame where all markers are visible.
+    Frames with occluded markers keep the pose of the last complete frame.
+    Returns R (T,3,3), v (T,3) and the RMS marker residual of the complete frames.
+    """
+    markers = c3dReader.c3dFile(source.path).markerTrajectories(source.labels)
+    complete = ~np.any(np.isnan(markers), axis=(1,2))
+    if not np.any(complete):
+        raise ValueError("c3dToRv: markers of " + source.name + " are never visible at the same time.")
+    M0 = source.reference if source.reference is not None else markers[np.argmax(complete)]
+
+    R, v, rms = kabsch(M0, markers[complete])
 
-def computeFHAworld(R, v):
+    # hold the last complete pose over gaps (the first one before it)
+    last = np.maximum.accumulate(np.where(complete, np.cumsum(complete) - 1, -1))
+    last[last < 0] = 0
+    return R[last], v[last], rms
+
+def motionFiles(motion_path):
+    """
+    Returns the motion source of every object in motion_path, sorted by object:
+    the binary _pose.npy file written by markerToRv, otherwise the pair of
+    _pos.txt and _rot.txt files. A .c3d trial (one per folder) provides
+    the objects listed in its marker config, see c3dReader.loadMarkerConfig.
+    Likewise, a .mat file provides the pose variables listed in its pose config,
+    see matLoader.loadPoseConfig. Sources can be loaded with loadPoses.
+    """
+    sources = {}
+    for c3d_path in sorted(glob(motion_path + "/*.c3d"))[:1]:
+        config_path = c3dReader.findMarkerConfig(c3d_path)
+        if config_path is None:
+            print("motionFiles: no " + c3dReader.MARKER_CONFIG_NAME + " found for " + c3d_path)
+            continue
+        for name, (labels, reference) in c3dReader.loadMarkerConfig(config_path).items():
+            sources[motion_path + "/" + name + "_"] = c3dReader.c3dMotion(c3d_path, name, labels, reference)
+    for mat_path in sorted(glob(motion_path + "/*.mat"))[:1]:
+        config_path = matLoader.findPoseConfig(mat_path)
+        if config_path is None:
+            print("motionFiles: no " + matLoader.POSE_CONFIG_NAME + " found for " + mat_path)
+            continue
+        mat = matLoader.matPoses(mat_path)
+        for name, variable in matLoader.loadPoseConfig(config_path).items():
+            sources[motion_path + "/" + name + "_"] = matLoader.matMotion(mat, name, variable)
+    for pos_path in glob(motion_path + "/*pos.txt"):
+        rot_path = pos_path[:-len("pos.txt")] + "rot.txt"
+        if os.path.exists(rot_path):
+            sources[pos_path[:-len("pos.txt")]] = (pos_path, rot_path)
+    for pose_path in glob(motion_path + "/*_pose.npy"):
+        sources[pose_path[:-len("pose.npy")]] = pose_path
+    return [sources[name] for name in sorted(sources)]
+
+def loadPoses(source, skiprows=1):
+    """
+    Loads the poses of one object from a motion source (see motionFiles).
+    As in the text files, the first skiprows timesteps are skipped.
+    Returns the rotations (T,9) (row-major) and translations (T,3) as float32.
+    """
+    if isinstance(source, c3dReader.c3dMotion):
+        R, v, _ = c3dToRv(source)
+        return R.reshape(-1, 9)[skiprows:].astype(np.float32), v[skiprows:].astype(np.float32)
+    if isinstance(source, matLoader.matMotion):
+        R, v = source.mat.poses(source.variable)
+        return R.reshape(-1, 9)[skiprows:].astype(np.float32), v[skiprows:].astype(np.float32)
+    if isinstance(source, str):
+        pose = np.load(source, mmap_mode='r')[skiprows:]
+        return pose[:,0:9], pose[:,9:12]
+    pos_path, rot_path = source
+    return loadMotionFile(rot_path, skiprows), loadMotionFile(pos_path, skiprows)
+
+def loadMotionFile(path, skiprows=1):
+    """
+    Loads a whitespace separated motion file (e.g. _pos.txt or _rot.txt) as float32 array.
+    The parsed array is cached in a sidecar .npy file (.cache/<name>.npy next to path),
+    keyed on the absolute path, size and mtime of the text file. Later loads open the
+    cache memory-mapped (read-only) instead of parsing the text again. The cache is
+    rebuilt whenever the text file changes.
+    """
+    return fileCache.cachedArray(path, os.path.basename(path),
+                                 lambda: np.loadtxt(path, skiprows=skiprows, dtype=np.float32), skiprows)
+
+def kabsch(M0, M):
+    """
+    Least squares rigid transformations M0 -> M[i] for all timesteps i
+    using the Kabsch algorithm, solved as one stacked SVD.
+    M0 are the marker positions in object coordinates with shape (m,3),
+    M the marker positions per timestep with shape (T,m,3).
+
+    Returns three np.arrays with one element per time step:
+      - R: rotation matrices, shape (T,3,3)
+      - v: translation vectors, shape (T,3)
+      - rms: root mean square distance of the transformed M0 to M
+    """
+    M0 = np.asarray(M0, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
+    M0_centroid = np.mean(M0, axis=0)
+    M_centroid = np.mean(M, axis=1)
+
+    # covariance matrices -> svd -> least squares rotations
+    H = np.einsum('mi,tmj->tij', M0 - M0_centroid, M - M_centroid[:,None,:])
+    U,_,Vt = np.linalg.svd(H)
+    V = Vt.transpose(0,2,1)
+    S = np.ones((H.shape[0], 3)) # check to ensure a right-hand system
+    S[:,2] = np.sign(np.linalg.det(V @ U.transpose(0,2,1)))
+    R = (V * S[:,None,:]) @ U.transpose(0,2,1)
+
+    # translations
+    v = M_centroid - R @ M0_centroid
+
+    # fit residuals
+    residuals = np.einsum('tij,mj->tmi', R, M0) + v[:,None,:] - M
+    rms = np.sqrt(np.mean(np.einsum('tmi,tmi->tm', residuals, residuals), axis=1))
+
+    return R, v, rms
+
+def stepViews(A, step=1, stride=1):
+    """
+    Returns the pre/post entries A[i], A[i+step] for every stride-th i
+    as two views of A (no copy is made).
+    """
+    return A[:-step:stride], A[step::stride]
+
+
+def computeFHAworld(R, v, step=1, stride=1):
     """
     Computes the finite helical axes from a list of model transformations R, v.
     The result is relative to the world ("traditional" FHA)
+    Each axis describes the motion from timestep i to i+step, for every stride-th i.
 
     Returns four np.arrays with one element per time step:
       - n: normal vector (direction) of helical axis
@@ -68,37 +305,28 @@ def computeFHAworld(R, v):
       - l: displacement length along axis (can be negative)
     """
     # shift entries
-    R_pre = R[:-1,:,:]
-    v_pre = v[:-1,:]
-    R_post = R[1:,:,:]
-    v_post = v[1:,:]
-
-    # result arrays containing every timestep
-    n =   np.zeros(v_pre.shape)
-    r0 =  np.zeros(v_pre.shape)
-    r0_displ_base = np.zeros(v_pre.shape[0])
-    r0_displ_tar =  np.zeros(v_pre.shape[0])
-    phi = np.zeros(v_pre.shape[0])
-    l =   np.zeros(v_pre.shape[0])
+    R_pre, R_post = stepViews(R, step, stride)
+    v_pre, v_post = stepViews(v, step, stride)
 
-    for i in range(v_pre.shape[0]):
-        # calculate pre->post matrices
-        R = R_post[i] @ R_pre[i].T
-        v = v_post[i] - (R @ v_pre[i])
+    # calculate pre->post matrices for all timesteps
+    R = R_post @ R_pre.transpose(0,2,1)
+    v = v_post - np.einsum('ijk,ik->ij', R, v_pre)
 
-        # calculate this timestep
-        n[i], r0[i], phi[i], l[i] = matrixVectorToHA(R, v)
+    # calculate all timesteps
+    n, r0, phi, l = batchMatrixVectorToHA(R, v)
 
-        # compute alternative locations for r0
-        r0_displ_tar[i]  = np.dot(n[i], v_pre[i])
+    # compute alternative locations for r0
+    r0_displ_base = np.zeros(v_pre.shape[0])
+    r0_displ_tar  = np.einsum('ij,ij->i', n, v_pre)
 
     return n, r0, r0_displ_base, r0_displ_tar, phi, l
 
 
-def computeFHAref(R_ref, v_ref, R, v):
+def computeFHAref(R_ref, v_ref, R, v, step=1, stride=1):
     """
     Computes the finite helical axes from a list of model transformations R, v.
     The result is relative to the transformations of a reference system R_ref, v_ref.
+    Each axis describes the motion from timestep i to i+step, for every stride-th i.
 
     Returns four np.arrays with one element per time step:
       - n: normal vector (direction) of helical axis
@@ -107,46 +335,33 @@ def computeFHAref(R_ref, v_ref, R, v):
       - l: displacement length along axis (can be negative)
     """
     # shift entries
-    R_pre = R[:-1,:,:]
-    v_pre = v[:-1,:]
-    R_post = R[1:,:,:]
-    v_post = v[1:,:]
-
-    R_ref_pre = R_ref[:-1,:,:]
-    v_ref_pre = v_ref[:-1,:]
-    R_ref_post = R_ref[1:,:,:]
-    v_ref_post = v_ref[1:,:]
-
-    # result arrays containing every timestep
-    n =             np.zeros(v_pre.shape)
-    r0 =            np.zeros(v_pre.shape)
-    r0_displ_base = np.zeros(v_pre.shape[0])
-    r0_displ_tar =  np.zeros(v_pre.shape[0])
-    phi =           np.zeros(v_pre.shape[0])
-    l =             np.zeros(v_pre.shape[0])
+    R_pre, R_post = stepViews(R, step, stride)
+    v_pre, v_post = stepViews(v, step, stride)
 
-    for i in range(v_pre.shape[0]):
-        # calculate pre->post matrices
-        R = R_post[i] @ R_pre[i].T
-        v = v_post[i] - (R @ v_pre[i])
-        R_ref = R_ref_post[i] @ R_ref_pre[i].T
-        v_ref = v_ref_post[i] - (R_ref @ v_ref_pre[i])
+    R_ref_pre, R_ref_post = stepViews(R_ref, step, stride)
+    v_ref_pre, v_ref_post = stepViews(v_ref, step, stride)
 
-        # rotation/translation relative to the reference system
-        R = R_ref.T @ R
-        v = R_ref.T @ (v - v_ref)
+    # calculate pre->post matrices for all timesteps
+    R = R_post @ R_pre.transpose(0,2,1)
+    v = v_post - np.einsum('ijk,ik->ij', R, v_pre)
+    R_ref = R_ref_post @ R_ref_pre.transpose(0,2,1)
+    v_ref = v_ref_post - np.einsum('ijk,ik->ij', R_ref, v_ref_pre)
 
-        # calculate this timestep
-        n[i], r0[i], phi[i], l[i] = matrixVectorToHA(R, v)
+    # rotation/translation relative to the reference system
+    R = np.einsum('ikj,ikl->ijl', R_ref, R)
+    v = np.einsum('ikj,ik->ij', R_ref, v - v_ref)
+
+    # calculate all timesteps
+    n, r0, phi, l = batchMatrixVectorToHA(R, v)
 
-        # compute alternative locations for r0
-        r0_displ_base[i] = np.dot(n[i], v_ref_pre[i])
-        r0_displ_tar[i]  = np.dot(n[i], v_pre[i])
+    # compute alternative locations for r0
+    r0_displ_base = np.einsum('ij,ij->i', n, v_ref_pre)
+    r0_displ_tar  = np.einsum('ij,ij->i', n, v_pre)
 
     return n, r0, r0_displ_base, r0_displ_tar, phi, l
 
 
-def computeFHAref_projectFirst(R_ref, v_ref, R, v):
+def computeFHAref_projectFirst(R_ref, v_ref, R, v, step=1, stride=1):
     """
     First projects R,v into the reference system, then computes the traditional
     FHA, then re-projects the system back into the world.
@@ -155,24 +370,130 @@ def computeFHAref_projectFirst(R_ref, v_ref, R, v):
     """
     # rotation/translation relative to the reference system
     R = R_ref.transpose(0,2,1) @ R
-    v -= v_ref
+    v = v - v_ref
     v = R_ref.transpose(0,2,1) @ v[:,:,None]
     v = v.reshape(-1,3)
 
     # compute traditional FHA
-    n, r0, phi, l = computeFHAworld(R, v)
+    n, r0, _, _, phi, l = computeFHAworld(R, v, step, stride)
 
     # re-project into world
-    n  = R_ref[:-1,:,:] @ n[:,:,None]
-    r0 = R_ref[:-1,:,:] @ r0[:,:,None] + v_ref[:-1,:,None]
+    R_ref_pre, _ = stepViews(R_ref, step, stride)
+    v_ref_pre, _ = stepViews(v_ref, step, stride)
+    n  = R_ref_pre @ n[:,:,None]
+    r0 = R_ref_pre @ r0[:,:,None] + v_ref_pre[:,:,None]
 
     return n.reshape(-1,3), r0.reshape(-1,3), phi, l
 
 
-def computeRHA(R_ref, v_ref, R_tar, v_tar):
+def computeFHAoutOfCore(R, v, out_dir, R_ref=None, v_ref=None, step=1, stride=1, chunk_size=2**16):
+    """
+    Out-of-core version of computeFHAworld (or computeFHAref, if R_ref, v_ref are given)
+    for pose streams larger than memory, e.g. memory-mapped pose files:
+      rot, pos = loadPoses("X_pose.npy"); R = rot.reshape(-1,3,3)
+    The inputs are read in chunks of chunk_size axes, overlapping by step frames
+    (the frames shared by the last and the next axis).
+    The results are written to memory-mapped .npy files in out_dir
+    (n.npy, r0.npy, r0_displ_base.npy, r0_displ_tar.npy, phi.npy, l.npy) and are
+    exactly the same as those of the in-memory computation.
+
+    Returns a dict of the memory-mapped results.
+    """
+    nr_axes = max(0, -(-(R.shape[0] - step) // stride))
+    shapes = {'n': (nr_axes, 3), 'r0': (nr_axes, 3), 'r0_displ_base': (nr_axes,),
+              'r0_displ_tar': (nr_axes,), 'phi': (nr_axes,), 'l': (nr_axes,)}
+    os.makedirs(out_dir, exist_ok=True)
+    out = {name: np.lib.format.open_memmap(os.path.join(out_dir, name + ".npy"), mode='w+',
+                                           dtype=np.float64, shape=shape)
+           for name, shape in shapes.items()}
+
+    for a0 in range(0, nr_axes, chunk_size):
+        a1 = min(a0 + chunk_size, nr_axes)
+        # frames of the axes a0..a1-1, including the post frame of the last axis
+        f0 = a0 * stride
+        f1 = (a1 - 1) * stride + step + 1
+        if R_ref is None:
+            result = computeFHAworld(R[f0:f1], v[f0:f1], step, stride)
+        else:
+            result = computeFHAref(R_ref[f0:f1], v_ref[f0:f1], R[f0:f1], v[f0:f1], step, stride)
+        for name, values in zip(shapes, result):
+            out[name][a0:a1] = values
+
+    for values in out.values():
+        values.flush()
+    return out
+
+
+def thresholdFrames(R, phi_min, window=16):
+    """
+    Selects frames such that the rotation from one selected frame to the next
+    is the first one exceeding phi_min (in rad). Starts at frame 0.
+    The cumulative sum of the frame-to-frame angles is an upper bound for the
+    angle between any two frames, so a binary search in this prefix array yields
+    the earliest frame that can exceed phi_min. From there, the exact angles are
+    tested in growing windows.
+
+    Returns the np.array of selected frame indices.
+    """
+    nr_timesteps = R.shape[0]
+    R = R.reshape(nr_timesteps, 9)
+    cos_min = np.cos(phi_min)
+
+    # cumulative rotation angle, cos(phi) = (trace(A.T @ B) - 1) / 2
+    cos_step = 0.5 * (np.einsum('ij,ij->i', R[:-1], R[1:]) - 1)
+    phi_cum = np.concatenate(([0.0], np.cumsum(np.arccos(np.clip(cos_step, -1.0, 1.0)))))
+
+    frames = [0]
+    while True:
+        a = frames[-1]
+        # earliest candidate (with tolerance for arccos round-off)
+        j = max(a+1, int(np.searchsorted(phi_cum, phi_cum[a] + phi_min - 1e-6)))
+        w = window
+        found = -1
+        while j < nr_timesteps:
+            candidates = np.arange(j, min(j+w, nr_timesteps))
+            cos_phi = 0.5 * (R[candidates] @ R[a] - 1)
+            hits = np.flatnonzero(cos_phi < cos_min)
+            if hits.size > 0:
+                found = candidates[hits[0]]
+                break
+            j = candidates[-1] + 1
+            w *= 2
+        if found < 0:
+            break
+        frames.append(found)
+
+    return np.array(frames)
+
+
+def computeFHAworld_threshold(R, v, phi_min):
+    """
+    Same as computeFHAworld, but each axis spans a variable number of timesteps:
+    from one selected frame to the first frame whose rotation exceeds phi_min (in rad).
+    Additionally returns the selected frame indices, axis i describes the motion
+    from frames[i] to frames[i+1].
+    """
+    frames = thresholdFrames(R, phi_min)
+    return computeFHAworld(R[frames], v[frames]) + (frames,)
+
+
+def computeFHAref_threshold(R_ref, v_ref, R, v, phi_min):
+    """
+    Same as computeFHAref, but each axis spans a variable number of timesteps:
+    from one selected frame to the first frame whose rotation relative to the
+    reference exceeds phi_min (in rad).
+    Additionally returns the selected frame indices, axis i describes the motion
+    from frames[i] to frames[i+1].
+    """
+    # orientation of R in the reference system
+    frames = thresholdFrames(R_ref.transpose(0,2,1) @ R, phi_min)
+    return computeFHAref(R_ref[frames], v_ref[frames], R[frames], v[frames]) + (frames,)
+
+
+def computeRHA(R_ref, v_ref, R_tar, v_tar, stride=1):
     """
     Computes the relational helical axes from a list of reference transformations
-    to target transformations.
+    to target transformations, for every stride-th timestep.
 
     Returns four np.arrays with one element per time step:
       - n: normal vector (direction) of helical axis
@@ -180,23 +501,339 @@ def computeRHA(R_ref, v_ref, R_tar, v_tar):
       - phi: rotation around axis in [0,pi]
       - l: displacement length along axis (can be negative)
     """
-    # result arrays containing every timestep
-    n =   np.zeros(v_tar.shape)
-    r0 =  np.zeros(v_tar.shape)
-    phi = np.zeros(v_tar.shape[0])
-    l =   np.zeros(v_tar.shape[0])
+    R_ref, v_ref = R_ref[::stride], v_ref[::stride]
+    R_tar, v_tar = R_tar[::stride], v_tar[::stride]
+
+    # rotation/translation from reference to target for all timesteps
+    R = R_tar @ R_ref.transpose(0,2,1)
+    v = v_tar - np.einsum('ijk,ik->ij', R, v_ref)
+
+    # calculate all timesteps
+    return batchMatrixVectorToHA(R, v)
 
-    for i in range(v_tar.shape[0]):
-        # rotation/translation from reference to target
-        R = R_tar[i] @ R_ref[i].T
-        v = v_tar[i] - (R @ v_ref[i])
 
-        # calculate this timestep
-        n[i], r0[i], phi[i], l[i] = matrixVectorToHA(R, v)
+def computeRHApairs(R, v, pairs=None, chunk_size=4096, stride=1):
+    """
+    Computes the relational helical axes between many pairs of objects at once.
+    R, v are the stacked rot_list/trans_list of all objects with shape (B,T,3,3)
+    and (B,T,3), e.g. np.stack([g.rot_list for g in vertebrae]).
+    pairs is a list of (reference, target) object indices. If not given,
+    every pair (i,j) with i < j is used, ordered as np.triu_indices(B, 1).
+    The computation is done in chunks of chunk_size timesteps, so memory
+    stays bounded by (number of pairs) x chunk_size transformations.
+    Only every stride-th timestep is used.
+
+    Returns four np.arrays with one row per pair and one element per time step:
+      - n: normal vector (direction) of helical axis, shape (P,T,3)
+      - r0: helical axis support vector closest to origin, shape (P,T,3)
+      - phi: rotation around axis in [0,pi], shape (P,T)
+      - l: displacement length along axis (can be negative), shape (P,T)
+    """
+    if pairs is None:
+        ref_idx, tar_idx = np.triu_indices(R.shape[0], 1)
+    else:
+        pairs = np.asarray(pairs, dtype=np.intp).reshape(-1,2)
+        ref_idx, tar_idx = pairs[:,0], pairs[:,1]
+    R, v = R[:,::stride], v[:,::stride]
+    nr_pairs = ref_idx.shape[0]
+    nr_timesteps = R.shape[1]
+
+    # result arrays containing every pair and timestep
+    n =   np.zeros((nr_pairs, nr_timesteps, 3))
+    r0 =  np.zeros((nr_pairs, nr_timesteps, 3))
+    phi = np.zeros((nr_pairs, nr_timesteps))
+    l =   np.zeros((nr_pairs, nr_timesteps))
+
+    for t0 in range(0, nr_timesteps, chunk_size):
+        t1 = min(t0 + chunk_size, nr_timesteps)
+        # gather all pairs of this chunk as one flat stack
+        R_ref = R[ref_idx, t0:t1].reshape(-1,3,3)
+        v_ref = v[ref_idx, t0:t1].reshape(-1,3)
+        R_tar = R[tar_idx, t0:t1].reshape(-1,3,3)
+        v_tar = v[tar_idx, t0:t1].reshape(-1,3)
+
+        n_c, r0_c, phi_c, l_c = computeRHA(R_ref, v_ref, R_tar, v_tar)
+        n[:, t0:t1]   = n_c.reshape(nr_pairs, -1, 3)
+        r0[:, t0:t1]  = r0_c.reshape(nr_pairs, -1, 3)
+        phi[:, t0:t1] = phi_c.reshape(nr_pairs, -1)
+        l[:, t0:t1]   = l_c.reshape(nr_pairs, -1)
 
     return n, r0, phi, l
 
 
+def savgolDerivative(x, dt, window=11, polyorder=3):
+    """
+    First time derivative of x (along axis 0) with a Savitzky-Golay filter.
+    A polynomial of degree polyorder is fitted to each window of samples,
+    the derivative of the fit is evaluated at the center. The first/last
+    window/2 samples use the derivative of the first/last fit at their position.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    nr_timesteps = x.shape[0]
+    window = min(window, nr_timesteps - (nr_timesteps+1) % 2) # odd, <= length
+    polyorder = min(polyorder, window - 1)
+    half = window // 2
+
+    # least squares polynomial fit -> derivative at every position of the window
+    t = np.arange(window) - half
+    V = np.vander(t, polyorder+1, increasing=True)
+    coeffs = np.linalg.pinv(V) # (polyorder+1, window)
+    powers = np.arange(1, polyorder+1)
+    D = (powers * t[:,None]**(powers-1)) @ coeffs[1:] # D[k] @ x_window = x'(t_k)
+    D /= dt
+
+    flat = x.reshape(nr_timesteps, -1)
+    dx = np.empty(flat.shape)
+    windows = np.lib.stride_tricks.sliding_window_view(flat, window, axis=0) # (T-window+1, C, window)
+    dx[half:nr_timesteps-half] = windows @ D[half]
+    dx[:half] = D[:half] @ flat[:window]
+    dx[nr_timesteps-half:] = D[half+1:] @ flat[-window:]
+
+    return dx.reshape(x.shape)
+
+
+def computeTwists(R, v, dt, window=11, polyorder=3):
+    """
+    Estimates the screw twists of a list of model transformations R, v
+    from Savitzky-Golay derivatives, seen in the same system as R, v.
+
+    Returns two np.arrays with one element per time step:
+      - w: angular velocity
+      - u: linear velocity of the (virtual) body point at the origin
+    """
+    R_dot = savgolDerivative(R, dt, window, polyorder)
+    v_dot = savgolDerivative(v, dt, window, polyorder)
+
+    # angular velocity from the skew-symmetric part of R_dot @ R.T
+    W = R_dot @ R.transpose(0,2,1)
+    w = 0.5 * np.stack((W[:,2,1] - W[:,1,2],
+                        W[:,0,2] - W[:,2,0],
+                        W[:,1,0] - W[:,0,1]), axis=-1)
+
+    # velocity of the point at the origin
+    u = v_dot - np.cross(w, v)
+
+    return w, u
+
+
+def twistToIHA(w, u, min_speed=0.1):
+    """
+    Computes the instantaneous helical axes from screw twists w, u
+    as described in (Stokdijk et al 1999), see calcIHA.m.
+    Axes of timesteps with an angular speed <= min_speed * max(angular speed)
+    are not reliable, their n and s are set to zero.
+
+    Returns four np.arrays with one element per time step:
+      - n: normal vector (direction) of helical axis
+      - s: helical axis support vector closest to origin
+      - w_abs: angular speed around axis (rad/s)
+      - l: translation velocity along axis (can be negative)
+    """
+    w_abs = np.linalg.norm(w, axis=1)
+    valid = w_abs > max(min_speed * np.max(w_abs, initial=0.0), 0.0)
+
+    n = np.zeros(w.shape)
+    s = np.zeros(w.shape)
+    n[valid] = w[valid] / w_abs[valid,None]
+    s[valid] = np.cross(w[valid], u[valid]) / w_abs[valid,None]**2
+    l = np.einsum('ij,ij->i', n, u)
+
+    return n, s, w_abs, l
+
+
+def computeIHAworld(R, v, dt, window=11, polyorder=3, min_speed=0.1):
+    """
+    Computes the instantaneous helical axes from a list of model transformations R, v,
+    relative to the world. dt is the time increment in s.
+
+    Returns six np.arrays with one element per time step:
+      - n: normal vector (direction) of helical axis
+      - s: helical axis support vector closest to origin
+      - s_displ_base: zero (no base)
+      - s_displ_tar: position of the target origin along the axis
+      - w_abs: angular speed around axis (rad/s)
+      - l: translation velocity along axis (can be negative)
+    """
+    w, u = computeTwists(R, v, dt, window, polyorder)
+    n, s, w_abs, l = twistToIHA(w, u, min_speed)
+
+    # alternative locations for s
+    s_displ_base = np.zeros(n.shape[0])
+    s_displ_tar  = np.einsum('ij,ij->i', n, v)
+
+    return n, s, s_displ_base, s_displ_tar, w_abs, l
+
+
+def computeIHAref(R_ref, v_ref, R, v, dt, window=11, polyorder=3, min_speed=0.1):
+    """
+    Computes the instantaneous helical axes from a list of model transformations R, v,
+    relative to the transformations of a reference system R_ref, v_ref.
+    The twists are estimated in the reference system, the axes are then
+    re-projected into the world. dt is the time increment in s.
+
+    Returns six np.arrays with one element per time step, see computeIHAworld.
+    """
+    # pose of the target in the reference system
+    R_refT = R_ref.transpose(0,2,1)
+    R_rel = R_refT @ R
+    v_rel = np.einsum('ijk,ik->ij', R_refT, v - v_ref)
+
+    w, u = computeTwists(R_rel, v_rel, dt, window, polyorder)
+    n, s, w_abs, l = twistToIHA(w, u, min_speed)
+
+    # re-project into world
+    valid = np.any(n != 0, axis=1)
+    n = np.einsum('ijk,ik->ij', R_ref, n)
+    s = np.einsum('ijk,ik->ij', R_ref, s) + v_ref * valid[:,None]
+    # move s along the axis to the point closest to the world origin (as in computeFHAref)
+    s -= np.einsum('ij,ij->i', s, n)[:,None] * n
+
+    # alternative locations for s
+    s_displ_base = np.einsum('ij,ij->i', n, v_ref)
+    s_displ_tar  = np.einsum('ij,ij->i', n, v)
+
+    return n, s, s_displ_base, s_displ_tar, w_abs, l
+
+
+def averageHelicalAxis(n, s, w_abs):
+    """
+    Average helical axis of a set of IHA, see calcIHA.m: optimal pivot point
+    (Stokdijk et al 1999) and optimal direction, both weighted with a logistic
+    function of the angular speed (Ehrig 2019).
+    Axes with n = 0 (undefined) are ignored.
+
+    Returns the direction n_opt (oriented along the weighted mean of n) and the pivot point s_opt.
+    """
+    valid = np.any(n != 0, axis=1)
+    n, s, w_abs = n[valid], s[valid], w_abs[valid]
+
+    # logistic weights on the normalized angular speed
+    wg = w_abs / np.max(w_abs)
+    wg = 1.0 / (1.0 + np.exp(-30.0 * (wg - 0.3)))
+
+    # optimal pivot point, mean of wg*(I - n n^T) s = mean of wg*(I - n n^T) s_opt
+    Q = wg[:,None,None] * (np.eye(3) - np.einsum('ij,ik->ijk', n, n))
+    # (least squares, for a pure hinge Q is singular along the axis)
+    s_opt = np.linalg.lstsq(np.mean(Q, axis=0), np.mean(Q @ s[:,:,None], axis=0), rcond=None)[0].reshape(3)
+
+    # optimal direction, dominant eigenvector of the weighted sum of n n^T
+    U, _, _ = np.linalg.svd(np.einsum('i,ij,ik->jk', wg, n, n))
+    n_opt = U[:,0]
+    # the sign of the eigenvector is arbitrary, point along the weighted mean input direction
+    if np.dot(n_opt, wg @ n) < 0:
+        n_opt = -n_opt
+
+    return n_opt, s_opt
+
+
+# chi2inv(0.95, 3), scale of the 95% confidence ellipsoids
+CHI2_95_3DOF = 7.814727903251178
+
+
+class ASAaccumulator():
+    """
+    Streaming version of twist2ASA.m (average screw axis, ASA).
+    Batches of screw twists (or FHA results) are folded into sufficient
+    statistics, so arbitrarily long recordings need O(1) memory.
+    Optional regularization as in twist2ASA.m:
+      - regul_pos: weight on the prior origin
+      - prior_origin: initial guess for the CoR
+      - regul_omega: 3x3 matrix added to the covariance of the rotations
+    """
+    def __init__(self, regul_pos=0.0, prior_origin=(0.0, 0.0, 0.0), regul_omega=None):
+        self.regul_pos = regul_pos
+        self.prior_origin = np.asarray(prior_origin, dtype=np.float64)
+        self.regul_omega = np.zeros((3,3)) if regul_omega is None else np.asarray(regul_omega, dtype=np.float64)
+
+        self.count = 0
+        self.omega_sum = np.zeros(3)          # sum of w
+        self.outerprod_sum = np.zeros((3,3))  # sum of w w^T
+        self.innerprod_sum = 0.0              # sum of |w|^2
+        self.crossprod_sum = np.zeros(3)      # sum of w x u
+        self.velocity_sum = 0.0               # sum of |u|^2
+
+    def addTwists(self, w, u):
+        """
+        Adds a batch of screw twists: angular velocities w (N,3) and
+        velocities u (N,3) of the point at the origin. Rows containing NaN are skipped.
+        """
+        w = np.asarray(w, dtype=np.float64).reshape(-1,3)
+        u = np.asarray(u, dtype=np.float64).reshape(-1,3)
+        valid = ~(np.isnan(w).any(axis=1) | np.isnan(u).any(axis=1))
+        w, u = w[valid], u[valid]
+
+        self.count += w.shape[0]
+        self.omega_sum += w.sum(axis=0)
+        self.outerprod_sum += w.T @ w
+        self.innerprod_sum += np.einsum('ij,ij->', w, w)
+        self.crossprod_sum += np.cross(w, u).sum(axis=0)
+        self.velocity_sum += np.einsum('ij,ij->', u, u)
+
+    def addFHA(self, n, r0, phi, l, timestep_size=1.0):
+        """
+        Adds a batch of finite helical axes (e.g. from computeFHAref)
+        as the equivalent twists of the screw motions per timestep.
+        """
+        w = n * (phi / timestep_size)[:,None]
+        u = n * (l / timestep_size)[:,None] + np.cross(r0, w)
+        self.addTwists(w, u)
+
+    def finalize(self):
+        """
+        Computes the ASA from all twists added so far.
+
+        Returns:
+          - n: ASA direction
+          - s: ASA position (CoR)
+          - T: 4x4 ASA frame, n is the x-axis
+          - analysis: dispersion of the orientation (dict)
+          - analysis2: dispersion of the position (dict)
+        """
+        nF = self.count
+        outer = self.outerprod_sum / nF
+        inner = self.innerprod_sum / nF
+
+        # CoR closest to all screw axes, weighted with the rotational velocity
+        A = (inner + self.regul_pos) * np.eye(3) - outer
+        s = np.linalg.solve(A, self.crossprod_sum / nF + self.regul_pos * self.prior_origin)
+
+        # ASA direction as the main direction of w, sign from the mean w
+        U, S, _ = np.linalg.svd(outer + self.regul_omega)
+        n = np.sign(np.dot(U[:,0], self.omega_sum)) * U[:,0]
+        e2 = U[:,2]
+        e3 = np.cross(n, e2)
+        T = np.eye(4)
+        T[:3,0] = n
+        T[:3,1] = e2
+        T[:3,2] = e3
+        T[:3,3] = s
+
+        # dispersion of the orientation
+        sigma = np.sqrt(S)
+        m = np.sqrt(CHI2_95_3DOF) * sigma
+        analysis = {'s': s,
+                    'va': U[:,0], 'vb': U[:,1], 'vc': U[:,2],
+                    'ma': m[0], 'mb': m[1], 'mc': m[2],
+                    'alpha1': np.sqrt((S[1] + S[2]) / S[0]),
+                    'alpha2': np.sqrt(S[2] / S[1]),
+                    'sigma_a': sigma[0], 'sigma_b': sigma[1], 'sigma_c': sigma[2]}
+
+        # dispersion of the position, sum of |u - s x w|^2 expanded into the sums
+        obj_p_asa = (self.velocity_sum - 2.0 * np.dot(s, self.crossprod_sum)
+                     + s @ (self.innerprod_sum * np.eye(3) - self.outerprod_sum) @ s)
+        obj_p_asa /= nF * (3*nF - 3)
+        U_orig, S_orig, _ = np.linalg.svd((self.innerprod_sum * np.eye(3) - self.outerprod_sum) / nF)
+        r_orig = np.sqrt(obj_p_asa / S_orig)
+        m_orig = np.sqrt(CHI2_95_3DOF) * r_orig
+        analysis2 = {'va': U_orig[:,0], 'vb': U_orig[:,1], 'vc': U_orig[:,2],
+                     'ma': m_orig[2], 'mb': m_orig[1], 'mc': m_orig[0],
+                     'alpha1': (r_orig[1] + r_orig[0]) / r_orig[2],
+                     'alpha2': r_orig[0] / r_orig[1],
+                     'sigma_a': r_orig[2], 'sigma_b': r_orig[1], 'sigma_c': r_orig[0]}
+
+        return n, s, T, analysis, analysis2
+
+
 def matrixVectorToHA(R, v):
     """
     Computes a single helical axis that describes the screwing
@@ -230,3 +867,58 @@ def matrixVectorToHA(R, v):
     r0 = -0.5*np.cross(n, n_cross_v) + sin_phi / (2.0*(1.0-cos_phi)) * n_cross_v
 
     return n, r0, phi, l
+
+
+def batchMatrixVectorToHA(R, v, eps=1e-12):
+    """
+    Computes the helical axes of a stack of rotations/translations R, v
+    with shape (N,3,3) and (N,3). Same as calling matrixVectorToHA per
+    element, but without any Python loop.
+    Transformations without rotation (sin_phi < eps) have no defined axis,
+    n, r0 and l are set to zero for these elements.
+
+    Returns four np.arrays with one element per transformation:
+      - n: normal vector (direction) of helical axis
+      - r0: helical axis support vector closest to origin
+      - phi: rotation around axis in [0,pi]
+      - l: displacement length along axis (can be negative)
+    """
+    R = np.asarray(R, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+
+    # skew-symmetric part of R, (R - R.T) = 2*sin_phi*[n]x
+    skew = np.stack((R[:,2,1] - R[:,1,2],
+                     R[:,0,2] - R[:,2,0],
+                     R[:,1,0] - R[:,0,1]), axis=-1)
+
+    # sine, cosine of rotation angle
+    sin_phi = 0.5 * np.sqrt(np.einsum('ij,ij->i', skew, skew))
+    cos_phi = 0.5 * (np.trace(R, axis1=1, axis2=2) - 1)
+
+    # use sine approximation, if sinphi <= (1/2)*sqrt(2), else use cosphi
+    use_sin = sin_phi <= 0.5*np.sqrt(2.0)
+    use_cos = ~use_sin
+    phi = np.zeros(R.shape[0])
+    phi[use_sin] = np.arcsin(sin_phi[use_sin])
+    flip = use_sin & (cos_phi < 0)
+    phi[flip] = np.pi - phi[flip]
+    phi[use_cos] = np.arccos(cos_phi[use_cos])
+    # re-compute for numerical precision
+    cos_phi = np.where(use_sin, np.cos(phi), cos_phi)
+    sin_phi = np.where(use_cos, np.sin(phi), sin_phi)
+
+    # helical axis, masked where the axis is undefined
+    valid = sin_phi >= eps
+    n = np.zeros(skew.shape)
+    n[valid] = skew[valid] / (2*sin_phi[valid,None])
+
+    # absolute translation along axis
+    l = np.einsum('ij,ij->i', n, v)
+
+    # axis support vector
+    n_cross_v = np.cross(n, v)
+    factor = np.zeros(R.shape[0])
+    factor[valid] = sin_phi[valid] / (2.0*(1.0-cos_phi[valid]))
+    r0 = -0.5*np.cross(n, n_cross_v) + factor[:,None] * n_cross_v
+
+    return n, r0, phi, l
@@ -44,6 +44,30 @@ TIME_COLORS = np.array([[255,255,204],
                         [ 44,127,184],
                         [ 37, 52,148]])
 
+# colors of axis clusters, axes without cluster are gray
+CLUSTER_COLORS = np.array([[228, 26, 28],
+                           [ 55,126,184],
+                           [ 77,175, 74],
+                           [152, 78,163],
+                           [255,127,  0],
+                           [166, 86, 40],
+                           [247,129,191]])
+CLUSTER_NOISE_COLOR = [190,190,190]
+
+# axis clustering (DBSCAN): distance at the joint (m), angle (rad), min. neighbors
+CLUSTER_EPS_DIST = 0.005
+CLUSTER_EPS_ANG = np.radians(10.0)
+CLUSTER_MIN_SAMPLES = 10
+# axes with |phi| <= CLUSTER_MIN_PHI * max |phi| are not clustered (unreliable location)
+CLUSTER_MIN_PHI = 0.1
+# larger glyph sets are clustered on every k-th axis to keep the GUI responsive
+CLUSTER_MAX_AXES = 10000
+
+# nearest-axis queries: weight of the axis angle against the r0 distance (m per rad)
+AXIS_INDEX_ANGLE_SCALE = CLUSTER_EPS_DIST / CLUSTER_EPS_ANG
+# live view: frames with axes within this radius of the previewed axis are marked in the scatterplot
+AXIS_SIMILAR_RADIUS = CLUSTER_EPS_DIST
+
 # color of bones
 REFERENCE_COLOR = [0.89, 0.85, 0.79] 
 
@@ -70,6 +94,9 @@ GLYPH_PATH_TIP = resource_path("models_glyphs/arrow_tip.obj")
 FHA_WORLD_TOOLTIPS = ["Select the target object.\nFHA will be relative to the world system."]
 FHA_BASE_TOOLTIPS =  ["Select the base object\nFHA will be relative to this system.",
                       "Select the target object."]
+IHA_WORLD_TOOLTIPS = ["Select the target object.\nIHA will be relative to the world system."]
+IHA_BASE_TOOLTIPS =  ["Select the base object\nIHA will be relative to this system.",
+                      "Select the target object."]
 RHA_TOOLTIPS =       ["Select the first object.\nRHA will use this as the start.",
                       "Select the second object.\nRHA will use this as the end."]
 
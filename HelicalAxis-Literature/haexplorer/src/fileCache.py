@@ -0,0 +1,63 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021 Pepe Eulzer. All rights reserved.
+# Distributed under the (new) BSD License.
+# -----------------------------------------------------------------------------
+
+import os
+
+import numpy as np
+
+def fileKey(path, *params):
+    """
+    Identifies the state of a file by its absolute path, size, mtime and optional parameters.
+    """
+    stat = os.stat(path)
+    return "\n".join([os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns)]
+                     + [str(p) for p in params])
+
+def readKey(key_path):
+    try:
+        with open(key_path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def writeKey(key_path, key):
+    try:
+        os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        with open(key_path, "w") as f:
+            f.write(key)
+    except OSError:
+        pass # read-only folder, the work is redone next time
+
+def cachedArray(source_path, name, compute, *params):
+    """
+    Returns the array compute() derived from the file source_path, cached in a
+    sidecar .npy file (.cache/<name>.npy next to source_path). The cache is keyed
+    on the path, size and mtime of source_path and params (see fileKey).
+    Valid caches are opened memory-mapped (read-only) without calling compute,
+    otherwise the cache is rebuilt.
+    """
+    cache_dir = os.path.dirname(os.path.abspath(source_path)) + "/.cache"
+    cache_path = cache_dir + "/" + name + ".npy"
+    key_path = cache_dir + "/" + name + ".key"
+    key = fileKey(source_path, *params)
+
+    # valid cache
+    if readKey(key_path) == key:
+        try:
+            return np.load(cache_path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+
+    # compute, then write the cache (replaced atomically, key last)
+    data = compute()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(cache_path + ".tmp.npy", data)
+        os.replace(cache_path + ".tmp.npy", cache_path)
+        writeKey(key_path, key)
+    except OSError:
+        pass # read-only folder, work without cache
+
+    return data
@@ -12,6 +12,7 @@ from PyQt5.QtGui import QMatrix4x4
 
 import helperGL
 import conversions
+import axisAnalysis
 from defaults import *
 
 class referenceGeometry():
@@ -19,7 +20,7 @@ class referenceGeometry():
     Handles buffers, modelmatrix, etc. of one reference object,
     for example a vertebra.
     """
-    def __init__(self, model_path, pos_path, rot_path, stencil_id, scale=1.0):
+    def __init__(self, model_path, motion_source, stencil_id, scale=1.0):
         # set stencil id
         self.stencil_id = stencil_id
 
@@ -33,12 +34,12 @@ class referenceGeometry():
 
         # load and buffer the geometry
         self.VAO, self.EBO_size = helperGL.obj_to_VAO(model_path)
-        self.loadModelMatrices(pos_path, rot_path, scale)
+        self.loadModelMatrices(motion_source, scale)
 
-    def loadModelMatrices(self, pos_path, rot_path, scale=1.0):
+    def loadModelMatrices(self, motion_source, scale=1.0):
         # setup a modelmatrix for each timestep
-        translations = np.loadtxt(pos_path, skiprows=1, dtype=np.float32)#[::100]
-        rotations    = np.loadtxt(rot_path, skiprows=1, dtype=np.float32)#[::100]
+        # motion_source is a _pose.npy file or a (_pos.txt, _rot.txt) pair, see conversions.motionFiles
+        rotations, translations = conversions.loadPoses(motion_source, skiprows=1)#[::100]
         assert(translations.shape[0] == rotations.shape[0])
 
         self.model_matrices = [QMatrix4x4() for i in range(len(translations))]
@@ -74,6 +75,8 @@ class glyphGeometry():
       - method: HA computation method used, one of
         * 'FHAworld' finite helical axis of tar w.r.t. world system
         * 'FHAref' finite helical axis of tar w.r.t. ref system, r0 closest to world origin
+        * 'IHAworld' instantaneous helical axis of tar w.r.t. world system
+        * 'IHAref' instantaneous helical axis of tar w.r.t. ref system, r0 closest to world origin
     """
     def __init__(self, shaft_path, tip_path, ref, tar, corr_color, timestep_size, method, r0_path=None, n_path=None):
         self.ref = ref
@@ -81,6 +84,8 @@ class glyphGeometry():
         self.scatterplot_l_phi = None
         self.scatterplot_l_phi_time = None
         self.scatterplot_l_phi_preview = None
+        self.scatterplot_l_phi_similar = None
+        self.similar_frame = None # frame whose similar frames are marked in the scatterplot
         self.lineplot_phi = None
         self.lineplot_l = None
         self.checkboxLayout = None
@@ -91,6 +96,7 @@ class glyphGeometry():
         self.n_path = n_path
         self.timestep_size = timestep_size
         self.to_be_deleted = False
+        self.color_by_cluster = False
 
         # create and load VAOs
         self.VAO_shaft, self.EBO_shaft_size = helperGL.obj_to_VAO(shaft_path)
@@ -110,6 +116,12 @@ class glyphGeometry():
             self.tar.outline_colors.append(self.corr_color)
 
     def bufferParameters(self):
+        # clusters and index of the previous axes are outdated
+        self.cluster_labels = None
+        self.cluster_representatives = None
+        self.axis_index = None
+        self.similar_frame = None
+
         # compute axes
         # ----------------------------------------
         if self.method == 'FHAworld':
@@ -126,9 +138,27 @@ class glyphGeometry():
                 self.tar.rot_list, self.tar.trans_list)
             self.nr_instances = n.shape[0]
 
-        # scale phi/l by timestep size -> velocities
-        phi /= self.timestep_size
-        l /= self.timestep_size
+        elif self.method == 'IHAworld':
+            self.name = "IHA " + self.tar.name + " world"
+            # compute the instantaneous helical axis of tar w.r.t. the world system
+            n, r0, r0_displ_base, r0_displ_tar, phi, l = conversions.computeIHAworld(
+                self.tar.rot_list, self.tar.trans_list, self.timestep_size)
+
+        elif self.method == 'IHAref':
+            self.name = "IHA " + self.tar.name + " base " + self.ref.name
+            # compute the instantaneous helical axis of tar w.r.t. ref
+            n, r0, r0_displ_base, r0_displ_tar, phi, l = conversions.computeIHAref(
+                self.ref.rot_list, self.ref.trans_list,
+                self.tar.rot_list, self.tar.trans_list, self.timestep_size)
+
+        if self.method in ['IHAworld', 'IHAref']:
+            # IHA are already velocities, keep one instance per FHA interval to match the time axis
+            n, r0, r0_displ_base, r0_displ_tar, phi, l = [a[:-1] for a in (n, r0, r0_displ_base, r0_displ_tar, phi, l)]
+            self.nr_instances = n.shape[0]
+        else:
+            # scale phi/l by timestep size -> velocities
+            phi /= self.timestep_size
+            l /= self.timestep_size
 
         # create surface
         # ----------------------------------------
@@ -144,7 +174,6 @@ class glyphGeometry():
                                                                 ("phi", np.float32),
                                                                 ("l", np.float32)])
         
-        self.instance_parameters["color"]         = helperGL.colormapRGB(TIME_COLORS, self.nr_instances)
         self.instance_parameters["n"]             = n
         self.instance_parameters["r0"]            = r0
         self.instance_parameters["r0_displ_base"] = r0_displ_base
@@ -152,6 +181,7 @@ class glyphGeometry():
         self.instance_parameters["phi"]           = phi
         self.instance_parameters["l"]             = l
         self.instance_parameters_l = self.instance_parameters["l"] # can be switched to |L|
+        self.instance_parameters["color"]         = self.instanceColors()
 
         # buffer data
         gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.VBO_parameters)
@@ -362,11 +392,106 @@ class glyphGeometry():
 
         gl.glBindVertexArray(0)
 
-    def registerPlotItems(self, scatter, scatter_t, scatter_preview, line_phi, line_l):
+    def clusterAxes(self):
+        """
+        Clusters the axes of this glyph set, see axisAnalysis.clusterAxes.
+        The result is kept until the axes are recomputed.
+        Returns the cluster label of each instance (-1: no cluster).
+        """
+        if self.cluster_labels is None:
+            self.cluster_labels, self.cluster_representatives = axisAnalysis.clusterAxes(
+                self.instance_parameters["n"], self.instance_parameters["r0"],
+                CLUSTER_EPS_DIST, CLUSTER_EPS_ANG, CLUSTER_MIN_SAMPLES,
+                phi=self.instance_parameters["phi"], min_phi=CLUSTER_MIN_PHI, max_axes=CLUSTER_MAX_AXES)
+        return self.cluster_labels
+
+    def getAxisIndex(self):
+        """
+        k-d tree over the axes (n, r0) of this glyph set, see axisAnalysis.axisIndex.
+        It is built on first use and kept until the axes are recomputed.
+        """
+        if self.axis_index is None:
+            self.axis_index = axisAnalysis.axisIndex(self.instance_parameters["n"],
+                                                     self.instance_parameters["r0"],
+                                                     AXIS_INDEX_ANGLE_SCALE)
+        return self.axis_index
+
+    def framesWithinRadius(self, frame, radius):
+        """
+        Returns all frames with axes within radius of the axis at frame.
+        """
+        return self.getAxisIndex().withinRadius(self.instance_parameters["n"][frame],
+                                                self.instance_parameters["r0"][frame], radius)
+
+    def updateSimilarFrames(self, frame, active=True):
+        """
+        Marks the frames with axes within AXIS_SIMILAR_RADIUS of the axis at frame
+        in the scatterplot (e.g. the previewed frame), nothing if not active.
+        The index is only queried when frame changes.
+        """
+        frame = frame if active else None
+        if frame == self.similar_frame:
+            return
+        self.similar_frame = frame
+        if frame is None or not np.any(self.instance_parameters["n"][frame]):
+            # no preview or undefined axis
+            self.scatterplot_l_phi_similar.setData([], [])
+            return
+        frames = self.framesWithinRadius(frame, AXIS_SIMILAR_RADIUS)
+        self.scatterplot_l_phi_similar.setData(self.instance_parameters["phi"][frames],
+                                               self.instance_parameters_l[frames])
+
+    def roiDispersion(self, phi_min, phi_max, l_min, l_max):
+        """
+        Dispersion of the axes within the phi/L ROI, see axisAnalysis.dispersionAnalysis.
+        The reference plane is normal to the average helical axis of the selected
+        axes (conversions.averageHelicalAxis, weighted with phi) at its pivot point.
+        Returns the analysis dict with the number of axes 'count', or None
+        if less than 3 defined axes are selected.
+        """
+        n = self.instance_parameters["n"]
+        r0 = self.instance_parameters["r0"]
+        phi = self.instance_parameters["phi"]
+        l = self.instance_parameters_l
+        mask = ((phi >= phi_min) & (phi <= phi_max) & (l >= l_min) & (l <= l_max)
+                & np.any(n != 0, axis=1))
+        if np.count_nonzero(mask) < 3 or np.max(np.abs(phi[mask])) <= 0:
+            return None
+        n, r0, phi = n[mask].astype(np.float64), r0[mask].astype(np.float64), phi[mask]
+
+        # reference frame, z-axis along the average axis
+        n_avg, s_avg = conversions.averageHelicalAxis(n, r0, np.abs(phi))
+        U, _, _ = np.linalg.svd(n_avg.reshape(3,1))
+        refT = np.eye(4)
+        refT[0:3,0] = U[:,1]
+        refT[0:3,1] = np.cross(n_avg, U[:,1])
+        refT[0:3,2] = n_avg
+        refT[0:3,3] = s_avg
+
+        analysis = axisAnalysis.dispersionAnalysis(np.hstack((n, r0)), refT, 0.0)
+        analysis['count'] = np.count_nonzero(~np.isnan(analysis['x']))
+        return analysis
+
+    def instanceColors(self):
+        if self.color_by_cluster:
+            return helperGL.categoricalRGB(CLUSTER_COLORS, self.clusterAxes(), CLUSTER_NOISE_COLOR)
+        return helperGL.colormapRGB(TIME_COLORS, self.nr_instances)
+
+    def setColorByCluster(self, status):
+        """
+        Colors the glyphs by axis cluster instead of by time.
+        """
+        self.color_by_cluster = bool(status)
+        self.instance_parameters["color"] = self.instanceColors()
+        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, self.VBO_parameters)
+        gl.glBufferSubData(gl.GL_ARRAY_BUFFER, 0, self.instance_parameters.nbytes, self.instance_parameters)
+
+    def registerPlotItems(self, scatter, scatter_t, scatter_preview, scatter_similar, line_phi, line_l):
         # necessary for dataset updates
         self.scatterplot_l_phi = scatter
         self.scatterplot_l_phi_time = scatter_t
         self.scatterplot_l_phi_preview = scatter_preview
+        self.scatterplot_l_phi_similar = scatter_similar
         self.lineplot_phi = line_phi
         self.lineplot_l = line_l
 
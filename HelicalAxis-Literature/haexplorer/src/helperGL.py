@@ -85,4 +85,20 @@ def colormapRGB(colors, sample_count):
     colormap[:,1] = np.interp(x_samples, x_axis, g)
     colormap[:,2] = np.interp(x_samples, x_axis, b)
 
-    return colormap
\ No newline at end of file
+    return colormap
+
+def categoricalRGB(colors, labels, other_color):
+    """
+    Returns one RGB value per label, cycling through colors.
+    Parameters:
+     * colors: numpy array of the form [[R1,G1,B1], [R2,G2,B2], ...]
+       The RGB values are expected in [0.0, 255.0]
+     * labels: integer labels, negative labels get other_color
+     * other_color: RGB value in [0.0, 255.0]
+    """
+    colormap = np.zeros((len(labels),3), dtype=np.float32)
+    colormap[:] = np.asarray(other_color) / 255.0
+    valid = labels >= 0
+    colormap[valid] = colors[labels[valid] % len(colors)] / 255.0
+
+    return colormap
@@ -357,6 +357,7 @@ class Scatter2D(pg.PlotWidget):
         self.items = []
         self.items_t = []
         self.items_preview = []
+        self.items_similar = []
 
         self.setLabel('left', "Translation Vel. (m/s)", **LABEL_STYLE)
         self.setLabel('bottom', "Rotation Vel. (rad/s)", **LABEL_STYLE)
@@ -382,9 +383,11 @@ class Scatter2D(pg.PlotWidget):
         s = pg.ScatterPlotItem(x=x, y=y, pen=None, size=SCATTER_POINT_SIZE, brush=color)
         st = pg.ScatterPlotItem(x=[0], y=[0], pen=None, size=SCATTER_POINT_SIZE*1.5, brush=color.darker(200))
         s_preview = pg.ScatterPlotItem(x=[0], y=[0], pen=color, size=SCATTER_POINT_SIZE*4, brush=color.lighter(200), symbol='+')
+        s_similar = pg.ScatterPlotItem(x=[], y=[], pen=pg.mkPen(color.darker(150), width=1.5), size=SCATTER_POINT_SIZE*2.5, brush=None)
         self.items.append(s)
         self.items_t.append(st)
         self.items_preview.append(s_preview)
+        self.items_similar.append(s_similar)
         self.addItem(s)
 
         # set time markers on top
@@ -392,6 +395,11 @@ class Scatter2D(pg.PlotWidget):
             self.removeItem(time_marker)
             self.addItem(time_marker)
 
+        # set similar axis markers on top
+        for similar_marker in self.items_similar:
+            self.removeItem(similar_marker)
+            self.addItem(similar_marker)
+
         # set preview markers on top
         for preview_marker in self.items_preview:
             self.removeItem(preview_marker)
@@ -399,7 +407,7 @@ class Scatter2D(pg.PlotWidget):
 
         self.resetROI()
 
-        return s, st, s_preview
+        return s, st, s_preview, s_similar
 
     def resetROI(self):
         x = np.array([item.data['x'] for item in self.items])
@@ -413,13 +421,15 @@ class Scatter2D(pg.PlotWidget):
         self.roi.setSize((size_x * 1.2, size_y * 1.2))
         self.enableAutoRange('xy', False)
 
-    def removePlotItems(self, s, st, s_preview):
+    def removePlotItems(self, s, st, s_preview, s_similar):
         self.removeItem(s)
         self.removeItem(st)
         self.removeItem(s_preview)
+        self.removeItem(s_similar)
         self.items.remove(s)
         self.items_t.remove(st)
         self.items_preview.remove(s_preview)
+        self.items_similar.remove(s_similar)
 
     def showROI(self, show):
         if show:
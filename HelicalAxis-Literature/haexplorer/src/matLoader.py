@@ -0,0 +1,141 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021 Pepe Eulzer. All rights reserved.
+# Distributed under the (new) BSD License.
+# -----------------------------------------------------------------------------
+
+import os
+
+import numpy as np
+
+import fileCache
+
+# file next to the .mat (or in the folder above) that assigns pose variables to objects
+POSE_CONFIG_NAME = "mat_poses.txt"
+
+
+class matPoses():
+    """
+    Lazy access to the pose variables of a MATLAB .mat file (v5, or v7.3 with h5py).
+    Variables are addressed by path, struct fields separated by dots, e.g.
+    "hinge.T1_0". Opening the file reads nothing, a variable is read on first
+    access (only its top-level variable is parsed) and cached as binary .npy
+    (.cache/<mat name>.<path>.npy next to the file), so later sessions open it
+    memory-mapped without touching the .mat again.
+    Supported pose layouts are homogeneous matrices (4,4,T) or (3,4,T) as
+    written by MATLAB, (T,4,4) or (T,3,4), and rows (T,12) in the format of
+    the _pose.npy files (row-major rotation followed by the translation).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.poses_cache = {}
+
+    def variables(self):
+        """
+        Returns the top-level variables as list of (name, shape, class) without loading them.
+        """
+        try:
+            import scipy.io
+            return scipy.io.whosmat(self.path)
+        except NotImplementedError:
+            h5py = importH5py()
+            with h5py.File(self.path, "r") as f:
+                return [(name, f[name].shape[::-1] if hasattr(f[name], "shape") else (1, 1),
+                         f[name].attrs.get("MATLAB_class", b"struct").decode())
+                        for name in f.keys() if not name.startswith("#")]
+
+    def poses(self, name):
+        """
+        Returns the poses of variable path name as rotations (T,3,3) and translations (T,3)
+        (views of one (T,12) float64 array, memory-mapped when loaded from the cache).
+        """
+        if name not in self.poses_cache:
+            cache_name = os.path.basename(self.path) + "." + name
+            pose = fileCache.cachedArray(self.path, cache_name, lambda: poseRows(self.read(name)))
+            self.poses_cache[name] = (pose[:,0:9].reshape(-1, 3, 3), pose[:,9:12])
+        return self.poses_cache[name]
+
+    def read(self, name):
+        """
+        Reads the variable path name from the file (uncached) in MATLAB dimension order.
+        """
+        fields = name.split(".")
+        try:
+            import scipy.io
+        except ImportError:
+            raise ImportError("matPoses: reading .mat files requires scipy") from None
+        try:
+            data = scipy.io.loadmat(self.path, variable_names=[fields[0]])
+        except NotImplementedError:
+            # v7.3 files are HDF5, datasets are stored in reversed dimension order
+            h5py = importH5py()
+            with h5py.File(self.path, "r") as f:
+                if name.replace(".", "/") not in f:
+                    raise KeyError("matPoses: variable " + name + " not found in " + self.path)
+                return np.asarray(f[name.replace(".", "/")], dtype=np.float64).T
+        if fields[0] not in data:
+            raise KeyError("matPoses: variable " + fields[0] + " not found in " + self.path)
+
+        value = data[fields[0]]
+        for field in fields[1:]:
+            if value.dtype.names is None or field not in value.dtype.names:
+                raise KeyError("matPoses: variable " + name + " not found in " + self.path)
+            value = value[field].flat[0]
+        return np.asarray(value, dtype=np.float64)
+
+
+class matMotion():
+    """
+    Motion source of one object stored as pose variable in a .mat file,
+    see conversions.motionFiles.
+    """
+    def __init__(self, mat, name, variable):
+        self.mat = mat
+        self.name = name
+        self.variable = variable
+
+
+def importH5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("matPoses: reading MATLAB v7.3 files requires h5py") from None
+    return h5py
+
+def poseRows(data):
+    """
+    Converts a pose variable (see matPoses) to rows (T,12): row-major rotation, translation.
+    """
+    if data.ndim == 2 and data.shape[1] == 12:
+        return np.ascontiguousarray(data)
+    if data.ndim == 3 and data.shape[0] in (3, 4) and data.shape[1] == 4:
+        data = np.moveaxis(data, 2, 0) # MATLAB stacks along the last dimension
+    if not (data.ndim == 3 and data.shape[1] in (3, 4) and data.shape[2] == 4):
+        raise ValueError("matPoses: unsupported pose layout " + str(data.shape))
+    return np.concatenate((data[:,0:3,0:3].reshape(-1, 9), data[:,0:3,3]), axis=1)
+
+def loadPoseConfig(path):
+    """
+    Reads a pose config: one line per object with the object name followed by
+    its pose variable in the .mat file, e.g.
+      proximal hinge.T1_0
+    Returns a dict name -> variable path.
+    """
+    config = {}
+    with open(path) as f:
+        for l in f.readlines():
+            entries = l.split()
+            if len(entries) < 2 or entries[0].startswith("#"):
+                continue
+            config[entries[0]] = entries[1]
+    return config
+
+def findPoseConfig(mat_path):
+    """
+    Returns the path of the pose config next to mat_path or in the folder above, or None.
+    """
+    head = os.path.dirname(os.path.abspath(mat_path))
+    for folder in (head, os.path.dirname(head)):
+        path = os.path.join(folder, POSE_CONFIG_NAME)
+        if os.path.exists(path):
+            return path
+    return None
@@ -0,0 +1,147 @@
+# -----------------------------------------------------------------------------
+# Copyright (c) 2021 Pepe Eulzer. All rights reserved.
+# Distributed under the (new) BSD License.
+# -----------------------------------------------------------------------------
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import conversions
+
+# data shared by all replicates, set once per worker process
+worker_data = None
+
+def rotationVectorsToMatrices(w):
+    """
+    Converts rotation vectors (N,3) (axis * angle) to rotation matrices (N,3,3)
+    with the Rodrigues formula.
+    """
+    phi = np.linalg.norm(w, axis=1)
+    n = np.divide(w, phi[:,None], out=np.zeros(w.shape), where=phi[:,None] > 0)
+    K = np.zeros((w.shape[0], 3, 3))
+    K[:,0,1], K[:,0,2], K[:,1,2] = -n[:,2], n[:,1], -n[:,0]
+    K[:,1,0], K[:,2,0], K[:,2,1] = n[:,2], -n[:,1], n[:,0]
+    return np.eye(3) + np.sin(phi)[:,None,None] * K + (1 - np.cos(phi))[:,None,None] * (K @ K)
+
+def perturbMarkers(markers, sigma, rng):
+    """
+    Adds isotropic Gaussian noise (standard deviation sigma) to marker
+    trajectories in the format of markerToRv, shape (1+T,m,3).
+    The first row (object coordinates) stays unchanged.
+    """
+    perturbed = np.array(markers, dtype=np.float64)
+    perturbed[1:] += rng.normal(scale=sigma, size=perturbed[1:].shape)
+    return perturbed
+
+def perturbPoses(R, v, sigma_rot, sigma_pos, rng):
+    """
+    Perturbs a pose stream R (T,3,3), v (T,3) with random rotations
+    (Gaussian rotation vectors, standard deviation sigma_rot in rad)
+    and Gaussian translation noise (standard deviation sigma_pos).
+    """
+    R_noise = rotationVectorsToMatrices(rng.normal(scale=sigma_rot, size=(R.shape[0], 3)))
+    return R_noise @ R, v + rng.normal(scale=sigma_pos, size=v.shape)
+
+def initWorker(data):
+    global worker_data
+    worker_data = data
+
+def replicateDeviations(seeds):
+    """
+    Computes one FHA replicate per seed on the perturbed worker_data and
+    returns its deviations from the unperturbed axes, shape (len(seeds),4,T):
+    angle to the unperturbed direction, distance to the unperturbed r0,
+    and the differences of phi and l.
+    """
+    d = worker_data
+    deviations = np.empty((len(seeds), 4, d['n'].shape[0]), dtype=np.float32)
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+
+        # perturb the input
+        poses = []
+        if 'markers' in d:
+            for M in d['markers']:
+                M = perturbMarkers(M, d['sigma_pos'], rng)
+                R, v, _ = conversions.kabsch(M[0], M[1:])
+                poses += [R, v]
+        else:
+            for R, v in zip(d['poses'][0::2], d['poses'][1::2]):
+                poses += list(perturbPoses(R, v, d['sigma_rot'], d['sigma_pos'], rng))
+
+        # recompute the axes
+        if len(poses) == 4:
+            n, r0, _, _, phi, l = conversions.computeFHAref(*poses, step=d['step'])
+        else:
+            n, r0, _, _, phi, l = conversions.computeFHAworld(*poses, step=d['step'])
+
+        # deviations from the unperturbed axes, location is the distance
+        # of the unperturbed r0 to the perturbed axis
+        deviations[i,0] = np.arccos(np.clip(np.einsum('ij,ij->i', n, d['n']), -1.0, 1.0))
+        deviations[i,1] = np.linalg.norm(np.cross(d['r0'] - r0, n), axis=1)
+        deviations[i,2] = phi - d['phi']
+        deviations[i,3] = l - d['l']
+
+    return deviations
+
+def bootstrapFHA(poses=None, markers=None, sigma_pos=0.0, sigma_rot=0.0, nr_replicates=1000,
+                 confidence=0.95, step=1, seed=0, max_workers=None, batch_size=50):
+    """
+    Monte-Carlo uncertainty of the finite helical axes.
+    The input is perturbed with Gaussian noise and the FHAs are recomputed
+    nr_replicates times, spread over a ProcessPoolExecutor in batches of
+    batch_size replicates (max_workers=0 computes everything in this process).
+    Input is either
+      - poses: [R, v] (world FHA) or [R_ref, v_ref, R, v] (FHA relative to ref),
+        perturbed with sigma_rot (rad) and sigma_pos
+      - markers: [M] or [M_ref, M], marker trajectories in the format of
+        markerToRv (first row in object coordinates), perturbed with sigma_pos
+    Every replicate has its own seed spawned from seed, so the results
+    do not depend on max_workers or batch_size.
+    Undefined axes (phi ~ 0) have no meaningful deviation, check phi.
+
+    Returns a dict with the unperturbed axes (n, r0, phi, l, shape (T,...))
+    and per-frame confidence bounds (T,):
+      - cone_angle: half opening angle of the direction confidence cone (rad)
+      - cone_radius: radius of the location confidence cylinder around the axis at r0
+      - phi_lower, phi_upper, l_lower, l_upper: confidence intervals of phi and l
+    """
+    data = {'sigma_pos': sigma_pos, 'sigma_rot': sigma_rot, 'step': step}
+    if markers is not None:
+        data['markers'] = [np.asarray(M, dtype=np.float64) for M in markers]
+        poses = []
+        for M in data['markers']:
+            R, v, _ = conversions.kabsch(M[0], M[1:])
+            poses += [R, v]
+    else:
+        poses = [np.asarray(p, dtype=np.float64) for p in poses]
+        data['poses'] = poses
+
+    # unperturbed axes
+    if len(poses) == 4:
+        n, r0, _, _, phi, l = conversions.computeFHAref(*poses, step=step)
+    else:
+        n, r0, _, _, phi, l = conversions.computeFHAworld(*poses, step=step)
+    data.update({'n': n, 'r0': r0, 'phi': phi, 'l': l})
+
+    # one independent seed per replicate
+    seeds = np.random.SeedSequence(seed).spawn(nr_replicates)
+    batches = [seeds[i:i+batch_size] for i in range(0, nr_replicates, batch_size)]
+    if max_workers == 0:
+        initWorker(data)
+        deviations = [replicateDeviations(b) for b in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=initWorker, initargs=(data,)) as executor:
+            deviations = list(executor.map(replicateDeviations, batches))
+    deviations = np.concatenate(deviations)
+
+    # per-frame quantiles over the replicates
+    alpha = 100.0 * (1.0 - confidence) / 2
+    cone_angle, cone_radius = np.percentile(deviations[:,0:2], 100.0 * confidence, axis=0)
+    (phi_lower, l_lower), (phi_upper, l_upper) = np.percentile(deviations[:,2:4], [alpha, 100.0 - alpha], axis=0)
+
+    return {'n': n, 'r0': r0, 'phi': phi, 'l': l,
+            'cone_angle': cone_angle, 'cone_radius': cone_radius,
+            'phi_lower': phi + phi_lower, 'phi_upper': phi + phi_upper,
+            'l_lower': l + l_lower, 'l_upper': l + l_upper}
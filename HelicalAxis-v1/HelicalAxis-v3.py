@@ -0,0 +1,49 @@
+import os
+import sys
+import numpy as np
+import matplotlib.pyplot as plt
+import pandas as pd
+
+from fha_quaternion import load_sensor_poses
+
+# the vectorized FHA computation of the HAExplorer
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HelicalAxis-Literature', 'haexplorer', 'src'))
+from conversions import computeFHAref
+
+##############################################################################################################
+#### enter file path and name (needs loc1_x..loc2_z columns, i.e. Polhemus data):
+
+path = './test_data/Polhemus_test_data/'
+filename = 'Polhemus_90degX(clean)_data.csv'
+
+##############################################################################################################
+
+data = pd.read_csv(path + filename)
+
+# full poses (rotation + translation) of femur (sensor 1) and tibia (sensor 2)
+R_femur, v_femur, R_tibia, v_tibia = load_sensor_poses(data)
+
+# finite helical axes of tibia w.r.t. femur between consecutive rows, all in one pass
+n, r0, r0_displ_base, r0_displ_tar, phi, l = computeFHAref(R_femur, v_femur, R_tibia, v_tibia)
+
+fig = plt.figure()
+ax = fig.add_subplot(121, projection='3d')
+ax.set_xlabel('X')
+ax.set_ylabel('Y')
+ax.set_zlabel('Z')
+
+# axes as line segments through r0
+moving = np.linalg.norm(n, axis=1) > 0
+start = r0[moving]
+end = r0[moving] + n[moving]
+for i in range(len(start)):
+    ax.plot([start[i][0], end[i][0]], [start[i][1], end[i][1]], [start[i][2], end[i][2]], color='b')
+
+ax2 = fig.add_subplot(222)
+ax2.plot(np.degrees(phi))
+ax2.set_ylabel('phi (deg)')
+ax3 = fig.add_subplot(224)
+ax3.plot(l)
+ax3.set_ylabel('l')
+
+plt.show()
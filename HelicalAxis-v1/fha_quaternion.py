@@ -0,0 +1,101 @@
+import numpy as np
+
+# columns of the two sensor quaternions in the IMU/Polhemus CSV files
+SENSOR1_COLUMNS = ['w1', 'x1', 'y1', 'z1']
+SENSOR2_COLUMNS = ['w2', 'x2', 'y2', 'z2']
+
+# columns of the two sensor positions in the Polhemus CSV files
+SENSOR1_LOC_COLUMNS = ['loc1_x', 'loc1_y', 'loc1_z']
+SENSOR2_LOC_COLUMNS = ['loc2_x', 'loc2_y', 'loc2_z']
+
+
+def load_sensor_quaternions(data):
+    """
+    Returns the quaternions (w,x,y,z) of both sensors of a CSV DataFrame as two (N,4) arrays,
+    normalized and without q/-q sign flips between rows (see make_quaternions_continuous).
+    """
+    q1 = make_quaternions_continuous(normalize_quaternions(data[SENSOR1_COLUMNS].to_numpy(dtype=np.float64)))
+    q2 = make_quaternions_continuous(normalize_quaternions(data[SENSOR2_COLUMNS].to_numpy(dtype=np.float64)))
+    return q1, q2
+
+def load_sensor_poses(data):
+    """
+    Returns the poses of both sensors of a Polhemus CSV DataFrame as rotation matrices (N,3,3)
+    and positions (N,3): R1, v1, R2, v2. These can be passed to conversions.computeFHAref.
+    """
+    q1, q2 = load_sensor_quaternions(data)
+    v1 = data[SENSOR1_LOC_COLUMNS].to_numpy(dtype=np.float64)
+    v2 = data[SENSOR2_LOC_COLUMNS].to_numpy(dtype=np.float64)
+    return quaternions_to_rotation_matrices(q1), v1, quaternions_to_rotation_matrices(q2), v2
+
+def quaternions_to_rotation_matrices(q):
+    """Converts unit quaternions (N,4) to a stack of 3x3 rotation matrices (N,3,3)."""
+    q0, q1, q2, q3 = np.moveaxis(q, -1, 0)
+    R = np.stack((1 - 2*q2*q2 - 2*q3*q3, 2*q1*q2 - 2*q0*q3, 2*q1*q3 + 2*q0*q2,
+                  2*q1*q2 + 2*q0*q3, 1 - 2*q1*q1 - 2*q3*q3, 2*q2*q3 - 2*q0*q1,
+                  2*q1*q3 - 2*q0*q2, 2*q2*q3 + 2*q0*q1, 1 - 2*q1*q1 - 2*q2*q2), axis=-1)
+    return R.reshape(q.shape[:-1] + (3, 3))
+
+def normalize_quaternions(q):
+    """Scales every row of an (N,4) quaternion array to unit length."""
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+def make_quaternions_continuous(q):
+    """
+    Flips the signs of a quaternion stream (N,4) so consecutive rows lie in the same hemisphere (dot product >= 0).
+    q and -q are the same rotation. A row flips if its dot product with the previous row is negative,
+    the sign of every row is the cumulative product of these flips. The first row keeps its sign.
+    """
+    if len(q) < 2:
+        return q
+    flips = np.where(np.einsum('ij,ij->i', q[1:], q[:-1]) < 0, -1.0, 1.0)
+    sign = np.concatenate(([1.0], np.cumprod(flips)))
+    return q * sign[:, None]
+
+def quaternion_conjugate(q):
+    """Conjugates (inverts, for unit quaternions) every row of an (N,4) quaternion array."""
+    return q * np.array([1.0, -1.0, -1.0, -1.0])
+
+def quaternion_multiply(p, q):
+    """Hamilton product p*q of two (N,4) quaternion arrays (w,x,y,z), row by row."""
+    pw, px, py, pz = np.moveaxis(p, -1, 0)
+    qw, qx, qy, qz = np.moveaxis(q, -1, 0)
+    return np.stack((pw*qw - px*qx - py*qy - pz*qz,
+                     pw*qx + px*qw + py*qz - pz*qy,
+                     pw*qy - px*qz + py*qw + pz*qx,
+                     pw*qz + px*qy - py*qx + pz*qw), axis=-1)
+
+def relative_quaternions(q_from, q_to):
+    """Rotations from q_from to q_to, i.e. the quaternion form of R_to @ R_from.T."""
+    return quaternion_multiply(q_to, quaternion_conjugate(q_from))
+
+def quaternion_to_helical_axis(q, eps=1e-12):
+    """
+    Converts unit quaternions (N,4) to helical axis directions n (N,3) and angles phi in [0,pi].
+    Rotations without a defined axis (phi ~ 0) get n = 0.
+    """
+    # q and -q are the same rotation, use the hemisphere with w >= 0
+    sign = np.where(q[:, 0] < 0, -1.0, 1.0)
+    w = q[:, 0] * sign
+    xyz = q[:, 1:] * sign[:, None]
+
+    sin_half = np.linalg.norm(xyz, axis=1)
+    phi = 2 * np.arctan2(sin_half, w)
+
+    n = np.zeros(xyz.shape)
+    valid = sin_half > eps
+    n[valid] = xyz[valid] / sin_half[valid, None]
+    return n, phi
+
+def calculate_fha(femur_quat, tibia_quat):
+    """Calculates the helical axis (n, phi) of tibia relative to femur for every row."""
+    return quaternion_to_helical_axis(relative_quaternions(femur_quat, tibia_quat))
+
+def calculate_fha_steps(femur_quat, tibia_quat, step=1, stride=1):
+    """
+    Calculates the finite helical axes (n, phi) of the knee motion between rows i and i+step,
+    for every stride-th row i, where the knee orientation is tibia relative to femur.
+    """
+    joint = relative_quaternions(femur_quat, tibia_quat)
+    # pre/post rows are strided views of joint, no copies
+    return quaternion_to_helical_axis(relative_quaternions(joint[:-step:stride], joint[step::stride]))